@@ -0,0 +1,152 @@
+"""
+Replays a recorded agent session (see replay.recorder, AGENT_RECORD in main.py) through the
+full agent loop at full speed, with every external service replaced by a local stand-in:
+
+    camera   replay.fakes.ReplayDroidCam serving the recorded frames
+    OpenAI   replay.mock_openai.MockOpenAIServer answering with the recorded turns
+    E2B      replay.fakes.FakeSandbox returning the recorded execute_python results
+    EV3      server.py --sim, the real command server on simulated motors, at a multiple of real time
+
+Reports throughput and the p50/p95 latency of every traced stage, so changes to encoding,
+memory or the robot protocol can be compared before they reach a robot.
+
+Usage:
+    python -m benchmarks.agent_replay sessions/kitchen --stream --repeat 3
+    python -m benchmarks.agent_replay --synthetic 50
+    python -m benchmarks.agent_replay --synthetic 10 --time-scale 1 --model-latency 1 --pipelined
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import main as agent
+from droidcam.scene import SceneChangeDetector
+from llm_agent.e2b_sandbox.backends import E2BBackend
+from llm_agent.e2b_sandbox.pool import SandboxPool
+from llm_agent.ev3.robot import RobotController
+from llm_agent.llm import OpenAIModel
+from llm_agent.memory import MemoryManager
+from replay.fakes import FakeSandbox, ReplayDroidCam
+from replay.mock_openai import MockOpenAIServer
+from replay.recorder import load_session
+from tracing.core import disable as disable_tracing, enable as enable_tracing
+
+from .ev3_server_load import free_port, start_simulated_server
+
+
+def synthetic_session(steps: int, directory: str, size=(480, 640)) -> list:
+    """
+    Writes `steps` random frames to `directory` and returns steps in the format of
+    load_session, each with a move, a speak and an execute_python call.
+    """
+    rng = np.random.default_rng(0)
+    session = []
+    for index in range(steps):
+        frame = os.path.join(directory, f"{index:06d}.jpg")
+        cv2.imwrite(frame, rng.integers(0, 256, (*size, 3), dtype=np.uint8))
+        code = f"sum(range({index + 1}))"
+        session.append({
+            "index": index,
+            "frame": frame,
+            "skipped": False,
+            "turns": [
+                {"content": None, "tool_calls": [
+                    [f"call_{index}_0", "move", json.dumps({"command": "forward", "duration": 1})],
+                    [f"call_{index}_1", "speak", json.dumps({"message": "I see a table and two chairs."})],
+                    [f"call_{index}_2", "execute_python", json.dumps({"code": code})],
+                ]},
+                {"content": f"Step {index}: moved forward and solved the problem.", "tool_calls": []},
+            ],
+            "tool_results": [{"tool_call_id": f"call_{index}_2", "name": "execute_python",
+                              "content": str(sum(range(index + 1)))}],
+        })
+    return session
+
+
+def execution_results(steps: list) -> dict:
+    """Code -> recorded execute_python output, for the fake sandbox."""
+    results = {}
+    for step in steps:
+        outputs = {result["tool_call_id"]: result["content"] for result in step["tool_results"]}
+        for turn in step["turns"]:
+            for call_id, name, arguments in turn["tool_calls"]:
+                if name == "execute_python" and call_id in outputs:
+                    results[json.loads(arguments)["code"]] = outputs[call_id]
+    return results
+
+
+def robot_commands(tracer) -> int:
+    """Robot commands completed so far, heartbeats excluded, from the robot.<command> spans."""
+    return sum(stats["count"] for name, stats in tracer.summary().items()
+               if name.startswith("robot.") and name not in ("robot.send", "robot.ping"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("session", nargs="?", help="Recorded session directory")
+    parser.add_argument("--synthetic", type=int, metavar="STEPS", help="Replay a generated session instead")
+    parser.add_argument("--stream", action="store_true", help="Stream the model responses")
+    parser.add_argument("--repeat", type=int, default=1, help="Replays of the session")
+    parser.add_argument("--time-scale", type=float, default=0.001,
+                        help="Real seconds per second of robot time on the simulated server, 1 is real time")
+    parser.add_argument("--model-latency", type=float, default=0.0, help="Simulated time to first token in seconds")
+    parser.add_argument("--step-delay", type=float, default=0.0,
+                        help="Sleep after every step of the sequential loop (main.STEP_DELAY on the robot)")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="Use main.run_pipelined, which prepares the next frame while a step is in flight")
+    parser.add_argument("--trace", help="Also write the per-iteration spans to this JSON lines file")
+    args = parser.parse_args()
+    if (args.session is None) == (args.synthetic is None):
+        parser.error("pass either a session directory or --synthetic")
+
+    with tempfile.TemporaryDirectory() as directory:
+        steps = load_session(args.session) if args.session else synthetic_session(args.synthetic, directory)
+        replayed = [step for step in steps if not step["skipped"]]
+        turns = [turn for step in replayed for turn in step["turns"]]
+        results = execution_results(replayed)
+
+        model_server = MockOpenAIServer(turns, latency=args.model_latency)
+        port = free_port()
+        ev3 = start_simulated_server(port, time_scale=args.time_scale)
+        robot = RobotController("127.0.0.1", port)
+        backend = E2BBackend(SandboxPool(factory=lambda: FakeSandbox(results, default="")))
+        llm = OpenAIModel(stream=args.stream, robot=robot, base_url=model_server.base_url, api_key="replay",
+                          execution_backend=backend)
+        tracer = enable_tracing(args.trace, summary_at_exit=False)
+
+        try:
+            for run in range(args.repeat):
+                model_server.reset()
+                droidcam = ReplayDroidCam(steps, loop=args.pipelined)
+                commands = robot_commands(tracer)
+                start = time.perf_counter()
+                if args.pipelined:
+                    agent.run_pipelined(llm, droidcam, iterations=len(steps), min_interval=0, memory=MemoryManager(),
+                                        scene=SceneChangeDetector(), verbose=False, max_frame_age=None)
+                else:
+                    agent.run(llm, droidcam, iterations=len(steps), step_delay=args.step_delay, memory=MemoryManager(),
+                              scene=SceneChangeDetector(), verbose=False)
+                elapsed = time.perf_counter() - start
+                sizes = model_server.request_sizes
+                print(f"run {run + 1}: {len(steps)} steps in {elapsed:.2f} s ({len(steps) / elapsed:.1f} steps/s), "
+                      f"{len(sizes)} model requests averaging {sum(sizes) / max(1, len(sizes)) / 1024:.1f} KiB, "
+                      f"{robot_commands(tracer) - commands} robot commands")
+            tracer.print_summary()
+        finally:
+            disable_tracing()
+            llm.close()
+            backend.close()
+            robot.close()
+            ev3.terminate()
+            ev3.wait()
+            model_server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Compares the DroidCam capture modes on a live stream.
+
+For every mode the handler runs for a while with a snapshot taken at a fixed interval
+(like the agent loop does), and we report process CPU usage and snapshot latency.
+
+Usage:
+    python -m benchmarks.droidcam_capture 192.168.0.10:4747 --duration 30 --interval 3
+"""
+
+import argparse
+import statistics
+import time
+
+from droidcam.core import CaptureMode, DroidCamHandler, LogLevel
+
+
+def run_mode(ip_address, capture_mode, duration, interval):
+    droidcam = DroidCamHandler(ip_address, log_level=LogLevel.NONE, capture_mode=capture_mode)
+    if droidcam.wait_for_frame(timeout=5) is None:
+        droidcam.close()
+        raise RuntimeError(f"No frames received from {ip_address}")
+
+    latencies = []
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    while time.perf_counter() - wall_start < duration:
+        time.sleep(interval)
+        start = time.perf_counter()
+        droidcam.take_snapshot(compression=50)
+        latencies.append(time.perf_counter() - start)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    frames = droidcam.frames.seq
+
+    droidcam.close()
+    return {
+        "cpu_percent": 100 * cpu / wall,
+        "frames": frames,
+        "snapshots": len(latencies),
+        "latency_p50_ms": 1000 * statistics.median(latencies),
+        "latency_max_ms": 1000 * max(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ip_address", help="DroidCam address, e.g. 192.168.0.10:4747")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run each mode")
+    parser.add_argument("--interval", type=float, default=3, help="Seconds between snapshots")
+    args = parser.parse_args()
+
+    for mode in CaptureMode:
+        result = run_mode(args.ip_address, mode, args.duration, args.interval)
+        print(f"{mode.name:<7} cpu={result['cpu_percent']:5.1f}%  frames={result['frames']:<5} "
+              f"snapshots={result['snapshots']:<3} latency p50={result['latency_p50_ms']:.1f} ms "
+              f"max={result['latency_max_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Load test of the EV3 command server (server.py) running with simulated motors and sound
+(`server.py --sim`, see ev3sim.py), so it runs on any Linux box or in CI.
+
+Measures
+- round trip of `ping`, answered without going through the channels,
+- scheduling latency: how much later than their nominal duration timed motions and
+  speech are acknowledged,
+- throughput of pipelined commands from one client and of several clients at once,
+- whether the tacho counts and the host-side odometry match the commanded motion.
+
+Usage:
+    python -m benchmarks.ev3_server_load --commands 2000 --clients 4
+    python -m benchmarks.ev3_server_load --host 192.168.0.42   # a running server, e.g. the brick
+"""
+
+import argparse
+import math
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from ev3sim import Sound
+from llm_agent.ev3.robot import RobotController
+from llm_agent.ev3.telemetry import Odometry
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORWARD_SPEED = 0.3 * 1050  # Degrees per second of `forward` (30 % of a large motor)
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_simulated_server(port, time_scale=1.0):
+    """Starts `server.py --sim` on `port` and waits until it accepts connections."""
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "server.py"), "--sim", "--port", str(port),
+                                "--time-scale", str(time_scale)], cwd=ROOT, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("server.py --sim did not start")
+
+
+def percentiles(values):
+    """p50 and p95 in milliseconds."""
+    values = sorted(values)
+    return 1000 * statistics.median(values), 1000 * values[max(0, math.ceil(0.95 * len(values)) - 1)]
+
+
+def round_trips(robot, command, count):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        robot.submit(command).result(30)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def pipelined(robot, command, count, in_flight):
+    """Commands per second with up to `in_flight` outstanding, and how many were answered with an error."""
+    start = time.perf_counter()
+    window, errors = [], 0
+    for _ in range(count):
+        window.append(robot.submit(command))
+        if len(window) >= in_flight:
+            errors += window.pop(0).exception(30) is not None
+    errors += sum(future.exception(30) is not None for future in window)
+    return count / (time.perf_counter() - start), errors
+
+
+def report(name, latencies, nominal=0.0):
+    p50, p95 = percentiles([latency - nominal for latency in latencies])
+    label = "late by" if nominal else "round trip"
+    print(f"{name:<28}{label:>11} p50={p50:8.2f} ms  p95={p95:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commands", type=int, default=2000, help="Commands per throughput test")
+    parser.add_argument("--in-flight", type=int, default=64, help="Maximum outstanding commands when pipelining")
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent clients in the multi-client test")
+    parser.add_argument("--host", help="Load-test a running server.py instead of starting a simulated one")
+    parser.add_argument("--port", type=int, default=12345)
+    args = parser.parse_args()
+
+    process = None
+    if args.host is None:
+        host, port = "127.0.0.1", free_port()
+        process = start_simulated_server(port)
+    else:
+        host, port = args.host, args.port
+    robot = RobotController(host, port)
+
+    try:
+        # Latency
+        report("ping", round_trips(robot, "ping", 200))
+        report("stop", round_trips(robot, "stop", 200))
+        report("forward 0.05", round_trips(robot, "forward 0.05", 50), nominal=0.05)
+        text = "I found a problem to solve"
+        report("say (6 words)", round_trips(robot, "say: " + text, 5),
+               nominal=Sound.speech_duration(text, "-a 200 -s 130"))
+
+        # Throughput of one client
+        rate, _ = pipelined(robot, "stop", args.commands, args.in_flight)
+        print(f"{'stop pipelined':<28}{rate:>11.0f} commands/s")
+        rate, cancelled = pipelined(robot, "forward 0", args.commands, args.in_flight)
+        print(f"{'forward 0 pipelined':<28}{rate:>11.0f} commands/s ({cancelled} preempted)")
+
+        # Throughput of several clients; they share the motion channel, so keep to commands answered inline
+        clients = [RobotController(host, port) for _ in range(args.clients)]
+        per_client = args.commands // args.clients
+        threads = [threading.Thread(target=pipelined, args=(client, "stop", per_client, args.in_flight))
+                   for client in clients]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        print(f"{str(args.clients) + ' clients pipelined':<28}{per_client * args.clients / elapsed:>11.0f} commands/s")
+        for client in clients:
+            client.close()
+
+        # Motor model: one second forward at 30 % turns both wheels FORWARD_SPEED degrees
+        robot.start_telemetry(20)
+        robot.wait_until_idle()
+        before = robot.telemetry.positions
+        robot.submit("forward 1").result(30)
+        robot.wait_until_idle()
+        after = robot.telemetry.positions
+        travel = [before[port] - after[port] for port in ("B", "C")]
+        print(f"{'forward 1 tacho counts':<28}{travel[0]:>7} / {travel[1]} degrees (expected {FORWARD_SPEED:.0f})")
+        millimeters = FORWARD_SPEED * Odometry().mm_per_degree
+        print(f"{'odometry after forward 1':<28}{robot.pose.distance:>7.1f} mm (expected {millimeters:.1f})")
+    finally:
+        robot.close()
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
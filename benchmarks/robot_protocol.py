@@ -0,0 +1,88 @@
+"""
+Loopback benchmark of the RobotController <-> EV3 server protocol.
+
+Starts a local stand-in server that acknowledges every request immediately, then measures
+the round-trip latency of one command at a time and the throughput with many commands
+in flight.
+
+Usage:
+    python -m benchmarks.robot_protocol --commands 5000 --in-flight 64
+"""
+
+import argparse
+import socket
+import statistics
+import threading
+import time
+
+from llm_agent.ev3.protocol import STATUS_OK, LineReader, encode_reply, parse_request
+from llm_agent.ev3.robot import RobotController
+
+
+def serve_stand_in(server_socket):
+    """Answers every request on every connection with an immediate ok."""
+    while True:
+        try:
+            client_socket, _ = server_socket.accept()
+        except OSError:
+            return
+        threading.Thread(target=_answer, args=(client_socket,), daemon=True).start()
+
+
+def _answer(client_socket):
+    reader = LineReader()
+    with client_socket:
+        while True:
+            data = client_socket.recv(65536)
+            if not data:
+                return
+            replies = []
+            for line in reader.feed(data):
+                request_id, command = parse_request(line)
+                replies.append(encode_reply(request_id, STATUS_OK, command))
+            client_socket.sendall(b"".join(replies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commands", type=int, default=5000)
+    parser.add_argument("--in-flight", type=int, default=64, help="Maximum outstanding commands when pipelining")
+    parser.add_argument("--host", help="Benchmark a running server.py instead of the stand-in")
+    parser.add_argument("--port", type=int, default=12345)
+    args = parser.parse_args()
+
+    if args.host is None:
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.bind(("127.0.0.1", 0))
+        server_socket.listen()
+        threading.Thread(target=serve_stand_in, args=(server_socket,), daemon=True).start()
+        host, port = server_socket.getsockname()
+    else:
+        host, port = args.host, args.port
+
+    robot = RobotController(host, port)
+
+    # Round trip: one command at a time
+    latencies = []
+    for _ in range(args.commands // 10):
+        start = time.perf_counter()
+        robot.submit("beep").result(5)
+        latencies.append(time.perf_counter() - start)
+    print(f"round trip   p50={1e6 * statistics.median(latencies):7.1f} us  "
+          f"p95={1e6 * statistics.quantiles(latencies, n=20)[-1]:7.1f} us")
+
+    # Pipelined: keep up to --in-flight commands outstanding
+    start = time.perf_counter()
+    in_flight = []
+    for _ in range(args.commands):
+        in_flight.append(robot.submit("beep"))
+        if len(in_flight) >= args.in_flight:
+            in_flight.pop(0).result(5)
+    for future in in_flight:
+        future.result(5)
+    elapsed = time.perf_counter() - start
+    print(f"pipelined    {args.commands / elapsed:9.0f} commands/s ({args.in_flight} in flight)")
+
+
+if __name__ == "__main__":
+    main()
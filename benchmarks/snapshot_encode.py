@@ -0,0 +1,82 @@
+"""
+Micro-benchmark of the snapshot-to-payload path on a synthetic frame.
+
+Compares the legacy path (copy, rotate, BGR->RGB, PIL resize, PIL JPEG, base64) with
+the fused `encode_frame` + `to_data_url`, reporting time per snapshot and the peak
+memory allocated while producing one payload.
+
+Usage:
+    python -m benchmarks.snapshot_encode --width 1280 --height 720 --runs 50
+"""
+
+import argparse
+import statistics
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from droidcam.core import encode_frame, encode_image_pil, to_data_url
+
+
+def legacy_payload(frame, compression):
+    """The pre-fusion take_snapshot + encode_image_pil pipeline."""
+    frame = frame.copy()
+    frame = cv2.rotate(frame, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    if 0 < compression < 100:
+        width, height = image.size
+        image = image.resize((int(width * compression / 100), int(height * compression / 100)), 3)
+    return f"data:image/jpeg;base64,{encode_image_pil(image)}"
+
+
+def fused_payload(frame, max_size, quality):
+    return to_data_url(encode_frame(frame, quality=quality, max_size=max_size))
+
+
+def measure(fn, runs):
+    fn()  # Warm up
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    payload = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak, len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--max-size", type=int, default=512, help="Longer side of the fused output")
+    parser.add_argument("--quality", type=int, default=80, help="JPEG quality of the fused output")
+    args = parser.parse_args()
+
+    # Smooth gradient plus noise, roughly as compressible as a real camera frame
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, args.width, dtype=np.float32)[None, :, None]
+    frame = np.clip(gradient + rng.normal(0, 12, (args.height, args.width, 3)), 0, 255).astype(np.uint8)
+
+    # Same output resolution for both paths
+    compression = 100 * args.max_size / max(args.width, args.height)
+    cases = {
+        "legacy": lambda: legacy_payload(frame, compression),
+        "fused": lambda: fused_payload(frame, args.max_size, args.quality),
+    }
+
+    for name, fn in cases.items():
+        seconds, peak, size = measure(fn, args.runs)
+        print(f"{name:<7} {1000 * seconds:7.2f} ms/snapshot  peak alloc {peak / 1024:8.1f} KiB  "
+              f"payload {size / 1024:7.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+
+# A single captured frame. `image` is a read-only view into a ring slot, which the producer
+# overwrites after `capacity` frames; copy it to keep it longer.
+Frame = namedtuple("Frame", ["seq", "timestamp", "image"])
+
+
+class FrameRing:
+    """
+    Fixed-capacity ring buffer of preallocated frames.
+
+    The producer decodes straight into the next free slot (see `next_slot`) and then
+    publishes it with `commit`. Every committed frame gets a monotonically increasing
+    sequence number and a capture timestamp (time.monotonic), so consumers can tell
+    fresh frames from stale ones and block until a newer frame arrives.
+    """
+
+    def __init__(self, capacity: int = 4):
+        if capacity < 2:
+            raise ValueError("FrameRing needs a capacity of at least 2")
+
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._seqs = [0] * capacity
+        self._timestamps = [0.0] * capacity
+        self._head = -1  # Index of the most recently committed slot
+        self._seq = 0  # Sequence number of the most recently captured frame
+        self._pending = None  # (seq, timestamp) of a marked frame that is not decoded yet
+        self._cond = threading.Condition()
+
+    @property
+    def seq(self) -> int:
+        """Sequence number of the newest frame (0 if nothing was captured yet)."""
+        return self._seq
+
+    def next_slot(self, shape=None, dtype=np.uint8):
+        """
+        Returns the preallocated array the producer should write the next frame into.
+
+        The slot is (re)allocated only when it is missing or its shape/dtype changed,
+        so in steady state no frame memory is allocated at all.
+
+        Args:
+            shape (tuple, optional): Expected frame shape. If None, the current slot is
+                                     returned as-is (may be None before the first frame).
+            dtype: Expected frame dtype.
+
+        Returns:
+            numpy.ndarray or None: The writable slot array.
+        """
+        index = (self._head + 1) % self.capacity
+        self._seqs[index] = 0  # Invalidate views of this slot before it gets overwritten
+        slot = self._slots[index]
+        if shape is not None and (slot is None or slot.shape != tuple(shape) or slot.dtype != dtype):
+            slot = np.empty(shape, dtype=dtype)
+            self._slots[index] = slot
+        return slot
+
+    @property
+    def pending(self):
+        """(seq, timestamp) of the newest frame that was marked but not decoded yet, or None."""
+        return self._pending
+
+    def commit(self, frame=None, timestamp: float = None, seq: int = None) -> int:
+        """
+        Publishes the next slot as the newest frame and wakes up waiting consumers.
+
+        Args:
+            frame (numpy.ndarray, optional): The decoded frame. If it is not the slot
+                                             returned by `next_slot` (e.g. the decoder
+                                             had to allocate), it replaces that slot.
+            timestamp (float, optional): Capture time (time.monotonic). Defaults to now.
+            seq (int, optional): Sequence number of a frame previously announced with
+                                 `mark`. If None, a new sequence number is assigned.
+
+        Returns:
+            int: The sequence number assigned to the frame.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        index = (self._head + 1) % self.capacity
+        if frame is not None and frame is not self._slots[index]:
+            self._slots[index] = frame
+
+        with self._cond:
+            if seq is None:
+                self._seq += 1
+                seq = self._seq
+            if self._pending is not None and self._pending[0] <= seq:
+                self._pending = None
+            self._seqs[index] = seq
+            self._timestamps[index] = timestamp
+            self._head = index
+            self._cond.notify_all()
+            return seq
+
+    def mark(self, timestamp: float = None) -> int:
+        """
+        Announces a frame that was captured but not decoded yet (grab-on-demand mode).
+
+        Waiters on `wait_for_seq` are woken up; the frame becomes visible through
+        `latest` only once it is decoded and passed to `commit` with the returned seq.
+
+        Args:
+            timestamp (float, optional): Capture time (time.monotonic). Defaults to now.
+
+        Returns:
+            int: The sequence number reserved for the frame.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        with self._cond:
+            self._seq += 1
+            self._pending = (self._seq, timestamp)
+            self._cond.notify_all()
+            return self._seq
+
+    def latest(self):
+        """
+        Returns the newest frame as a zero-copy, read-only view.
+
+        Returns:
+            Frame or None: The newest frame, or None if nothing was captured yet.
+        """
+        with self._cond:
+            return self._frame_at(self._head)
+
+    def wait_for_seq(self, after_seq: int = 0, timeout: float = None) -> bool:
+        """
+        Blocks until a frame newer than `after_seq` was captured (decoded or only marked).
+
+        Returns:
+            bool: True if such a frame exists, False if the timeout expired.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._seq > after_seq, timeout)
+
+    def wait_for_frame(self, after_seq: int = 0, timeout: float = None):
+        """
+        Blocks until a decoded frame newer than `after_seq` is available.
+
+        Args:
+            after_seq (int): Only frames with a greater sequence number are returned.
+            timeout (float, optional): Maximum time to wait in seconds. None waits forever.
+
+        Returns:
+            Frame or None: The newest frame, or None if the timeout expired.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._head >= 0 and self._seqs[self._head] > after_seq, timeout):
+                return None
+            return self._frame_at(self._head)
+
+    def _frame_at(self, index):
+        if index < 0 or self._slots[index] is None:
+            return None
+        view = self._slots[index].view()
+        view.flags.writeable = False
+        return Frame(self._seqs[index], self._timestamps[index], view)
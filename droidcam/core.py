@@ -8,6 +8,11 @@ import numpy as np
 import io
 import base64
 
+from tracing.core import span
+
+from .buffer import FrameRing
+from .writer import Backpressure, ImageFormat, SnapshotWriter
+
 class LogLevel(Enum):
     NONE = 0
     BASIC = 1
@@ -15,13 +20,20 @@ class LogLevel(Enum):
     SNAPSHOT = 3  # Save all snapshots with timestamps
 
 
+class CaptureMode(Enum):
+    DECODE = 0  # Decode every frame in the background thread
+    GRAB = 1  # Only grab frames in the background, decode on demand
+
+
 import threading
 
 
 
 
 class DroidCamHandler:
-    def __init__(self, ip_address, log_level=LogLevel.BASIC, snapshot_dir="snapshots"):
+    def __init__(self, ip_address, log_level=LogLevel.BASIC, snapshot_dir="snapshots", buffer_size=4,
+                 capture_mode=CaptureMode.DECODE, snapshot_format=ImageFormat.JPEG, snapshot_quality=90,
+                 snapshot_backpressure=Backpressure.DROP):
         if not ip_address.startswith("http://"):
             ip_address = f"http://{ip_address}"
         if not ip_address.endswith("/video"):
@@ -30,13 +42,22 @@ class DroidCamHandler:
         self.ip_address = ip_address
         self.cap = None
         self.log_level = log_level
+        self.capture_mode = capture_mode
+        self._cap_lock = threading.Lock()  # VideoCapture is not thread-safe (grab vs retrieve)
+        self._frame_shape = None
         self.snapshot_dir = snapshot_dir
-        self.latest_frame = None  # Store the latest frame
+        self.frames = FrameRing(buffer_size)  # Ring of the most recent frames
+        self.last_snapshot_seq = 0  # Sequence number of the frame used by the last snapshot
         self.streaming = False  # Flag to control the background thread
 
-        if self.log_level == LogLevel.SNAPSHOT and not os.path.exists(self.snapshot_dir):
-            os.makedirs(self.snapshot_dir)
-            self._log(f"Created snapshot directory: {self.snapshot_dir}")
+        self.snapshot_writer = None  # Background writer, only used with LogLevel.SNAPSHOT
+
+        if self.log_level == LogLevel.SNAPSHOT:
+            if not os.path.exists(self.snapshot_dir):
+                self._log(f"Created snapshot directory: {self.snapshot_dir}")
+            self.snapshot_writer = SnapshotWriter(self.snapshot_dir, image_format=snapshot_format,
+                                                  quality=snapshot_quality, backpressure=snapshot_backpressure,
+                                                  log=self._log)
 
         self.open_stream()
 
@@ -45,13 +66,55 @@ class DroidCamHandler:
             timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             print(f"[{timestamp}] DroidCam: {message}")
 
+    @property
+    def latest_frame(self):
+        """The most recent frame as a read-only view, or None if nothing was captured yet."""
+        frame = self._latest()
+        return None if frame is None else frame.image
+
+    def _latest(self):
+        """Returns the newest Frame, decoding the last grabbed one first in GRAB mode."""
+        if self.capture_mode == CaptureMode.GRAB:
+            self._retrieve_pending()
+        return self.frames.latest()
+
     def _update_frames(self):
-        """Continuously updates the latest frame in a background thread."""
-        while self.streaming and self.cap.isOpened():
-            ret, frame = self.cap.read()
+        """Continuously captures frames into the ring buffer in a background thread."""
+        # Both cap.read() and cap.grab() block until the next frame arrives, so there is no need to sleep.
+        # They run under _cap_lock, which close() takes to release the capture.
+        while self.streaming:
+            if self.capture_mode == CaptureMode.GRAB:
+                with self._cap_lock:
+                    if not self.streaming or not self.cap.isOpened():
+                        break
+                    ret = self.cap.grab()
+                    if ret:
+                        self.frames.mark()  # Before a retrieve can decode this grab under the previous seq
+            else:
+                slot = self.frames.next_slot(self._frame_shape)
+                with self._cap_lock:
+                    if not self.streaming or not self.cap.isOpened():
+                        break
+                    ret, frame = self.cap.read(slot) if slot is not None else self.cap.read()
+                if ret:
+                    self._frame_shape = frame.shape
+                    self.frames.commit(frame)
+
+            if not ret:
+                time.sleep(0.01)  # Back off on stream hiccups instead of spinning
+
+    def _retrieve_pending(self):
+        """Decodes the most recently grabbed frame into the ring buffer (GRAB mode only)."""
+        with self._cap_lock:
+            pending = self.frames.pending
+            if pending is None or self.cap is None:
+                return
+            seq, timestamp = pending
+            slot = self.frames.next_slot(self._frame_shape)
+            ret, frame = self.cap.retrieve(slot) if slot is not None else self.cap.retrieve()
             if ret:
-                self.latest_frame = frame  # Store the most recent frame
-            time.sleep(0.001)  # Tiny delay to avoid overloading the CPU
+                self._frame_shape = frame.shape
+                self.frames.commit(frame, timestamp=timestamp, seq=seq)
 
     def open_stream(self):
         """Opens the stream and starts the background thread for frame updates."""
@@ -62,7 +125,7 @@ class DroidCamHandler:
 
         self.streaming = True
         threading.Thread(target=self._update_frames, daemon=True).start()  # Start the background frame update thread
-        self._log(f"Stream opened successfully", LogLevel.SNAPSHOT)
+        self._log(f"Stream opened successfully ({self.capture_mode.name.lower()} mode)", LogLevel.SNAPSHOT)
         return True
 
     def stream_video(self, window_name="DroidCam Stream"):
@@ -85,7 +148,42 @@ class DroidCamHandler:
         cv2.destroyWindow(window_name)
         self._log("Stream display closed", LogLevel.VERBOSE)
 
-    def take_snapshot(self, compression: int = 100) -> Image:
+    def wait_for_frame(self, after_seq: int = 0, timeout: float = None):
+        """
+        Blocks until a frame newer than `after_seq` has been captured.
+
+        Args:
+            after_seq (int): Sequence number the returned frame must be newer than.
+            timeout (float, optional): Maximum time to wait in seconds. None waits forever.
+
+        Returns:
+            Frame or None: (seq, timestamp, read-only image view), or None on timeout.
+        """
+        if self.capture_mode == CaptureMode.GRAB:
+            if not self.frames.wait_for_seq(after_seq, timeout):
+                return None
+            self._retrieve_pending()
+            timeout = 0  # The frame was just decoded, don't wait any further
+        return self.frames.wait_for_frame(after_seq, timeout)
+
+    def get_frame(self, after_seq: int = None, timeout: float = 1.0):
+        """
+        Returns the latest frame, or waits for one newer than `after_seq`.
+
+        Returns:
+            Frame or None: (seq, timestamp, read-only image view), or None if no frame is available.
+        """
+        with span("camera.get_frame", waited=after_seq is not None):
+            if after_seq is None:
+                snapshot = self._latest()
+            else:
+                snapshot = self.wait_for_frame(after_seq, timeout)
+
+        if snapshot is None:
+            self._log("Error: No frame available for snapshot.", LogLevel.BASIC)
+        return snapshot
+
+    def take_snapshot(self, compression: int = 100, after_seq: int = None, timeout: float = 1.0) -> Image:
         """
         Takes a snapshot of the latest frame being streamed, rotates it left,
         optionally compresses it, saves it if verbosity is high, and returns a PIL image.
@@ -93,17 +191,21 @@ class DroidCamHandler:
         Args:
             compression (int): Compression level (percentage of original size).
                                100 = No compression, 50 = Half size, etc.
+            after_seq (int, optional): Wait for a frame newer than this sequence number,
+                                       e.g. `last_snapshot_seq` to never reuse a frame.
+            timeout (float): Maximum time to wait for a newer frame in seconds.
 
         Returns:
             PIL.Image.Image: The compressed image object if successful, otherwise None.
             str: File path of the saved snapshot if saved, otherwise None.
         """
-        if self.latest_frame is None:
-            self._log("Error: No frame available for snapshot.", LogLevel.BASIC)
+        snapshot = self.get_frame(after_seq, timeout)
+        if snapshot is None:
             return None
 
-        frame = self.latest_frame.copy()
-        frame = cv2.rotate(frame, cv2.ROTATE_90_COUNTERCLOCKWISE)  # Rotate left
+        self.last_snapshot_seq = snapshot.seq
+        # cv2.rotate writes a new array, so the read-only ring view needs no copy
+        frame = cv2.rotate(snapshot.image, cv2.ROTATE_90_COUNTERCLOCKWISE)  # Rotate left
 
         # Convert OpenCV image (NumPy array) to PIL image
         image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
@@ -115,15 +217,58 @@ class DroidCamHandler:
             new_height = int(height * (compression / 100))
             image = image.resize((new_width, new_height), 3)
 
-        # Save compressed image using `save_snapshot`
-        saved_path = None
-        if self.log_level == LogLevel.SNAPSHOT:
-            success, saved_path = self.save_snapshot(frame=cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR))
-            if success:
-                print(f"Compressed snapshot saved at: {saved_path}")
+        # Hand the compressed image over to the background writer
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.submit(frame=np.asarray(image), rgb=True)
 
         return image
 
+    def encode_snapshot(self, quality: int = 80, max_size: int = 512, data_url: bool = False,
+                        after_seq: int = None, timeout: float = 1.0, snapshot=None, persist: bool = True):
+        """
+        Takes a snapshot of the latest frame and encodes it straight to JPEG.
+
+        Unlike `take_snapshot` + `encode_image_pil`, the frame is downscaled before it is
+        rotated and encoded directly from BGR with OpenCV, without any PIL round trip.
+
+        Args:
+            quality (int): JPEG quality (0-100).
+            max_size (int, optional): Maximum length of the longer image side in pixels.
+                                      None keeps the original resolution.
+            data_url (bool): Return a base64 `data:image/jpeg` URL instead of raw bytes.
+            after_seq (int, optional): Wait for a frame newer than this sequence number.
+            timeout (float): Maximum time to wait for a newer frame in seconds.
+            snapshot (Frame, optional): Encode this frame (e.g. from `get_frame`) instead of
+                                        fetching the latest one.
+            persist (bool): Hand the JPEG to the snapshot writer. Pass False for snapshots
+                            that may never be used and `persist_snapshot` the ones that are.
+
+        Returns:
+            bytes or str: The JPEG bytes (or data URL) if successful, otherwise None.
+        """
+        if snapshot is None:
+            snapshot = self.get_frame(after_seq, timeout)
+            if snapshot is None:
+                return None
+
+        self.last_snapshot_seq = snapshot.seq
+        jpeg = encode_frame(snapshot.image, quality=quality, max_size=max_size)
+        if jpeg is None:
+            self._log("Error: JPEG encoding failed.", LogLevel.BASIC)
+            return None
+
+        if persist:
+            self.persist_snapshot(jpeg)
+
+        if data_url:
+            return to_data_url(jpeg)
+        return jpeg
+
+    def persist_snapshot(self, jpeg: bytes):
+        """Hands an encoded snapshot to the snapshot writer, if snapshots are logged."""
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.submit(data=jpeg, data_format=ImageFormat.JPEG)
+
     def save_snapshot(self, filename=None, frame=None):
         """
         Saves a snapshot as a PNG file and returns the file path.
@@ -161,8 +306,12 @@ class DroidCamHandler:
         Returns:
             None
         """
+        self.streaming = False  # Stop the background capture thread
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.close()  # Flush pending snapshots
         if self.cap is not None and self.cap.isOpened():
-            self.cap.release()
+            with self._cap_lock:  # Waits for a read or grab in progress
+                self.cap.release()
             cv2.destroyAllWindows()
             self._log("DroidCam connection closed.", LogLevel.VERBOSE)
         self.cap = None
@@ -175,6 +324,45 @@ def encode_image_pil(image):
     return base64.b64encode(buffered.getvalue()).decode("utf-8")
 
 
+def encode_frame(frame, quality: int = 80, max_size: int = 512, rotate=cv2.ROTATE_90_COUNTERCLOCKWISE):
+    """
+    Downscales, rotates and JPEG-encodes a BGR frame in a single pass.
+
+    Resizing happens first so the rotation only touches the small image.
+
+    Args:
+        frame (numpy.ndarray): BGR frame as captured by OpenCV.
+        quality (int): JPEG quality (0-100).
+        max_size (int, optional): Maximum length of the longer side in pixels. None keeps the size.
+        rotate (int, optional): cv2 rotation code, None to keep the orientation.
+
+    Returns:
+        bytes: The JPEG image, or None if encoding failed.
+    """
+    height, width = frame.shape[:2]
+    if max_size and max(width, height) > max_size:
+        scale = max_size / max(width, height)
+        with span("camera.resize"):
+            frame = cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+
+    if rotate is not None:
+        with span("camera.rotate"):
+            frame = cv2.rotate(frame, rotate)
+
+    with span("camera.jpeg_encode"):
+        ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        return None
+    return buffer.tobytes()
+
+
+def to_data_url(jpeg: bytes) -> str:
+    """Wraps JPEG bytes into a base64 data URL accepted by the OpenAI vision API."""
+    with span("camera.base64"):
+        return "data:image/jpeg;base64," + base64.b64encode(jpeg).decode("ascii")
+
+
 if __name__ == "__main__":
     droidcam_ip = DROIDCAM_IP
 
@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+
+
+class SceneChangeDetector:
+    """
+    Decides whether the camera view changed significantly since a reference frame.
+
+    Each frame is reduced to a 64-bit difference hash (dHash) and a small grayscale
+    thumbnail. A frame counts as unchanged when both the hash Hamming distance and the
+    mean absolute thumbnail difference stay under their thresholds, so small sensor
+    noise or lighting flicker does not trigger a new LLM call, but moving the robot does.
+    """
+
+    def __init__(self, hash_threshold: int = 6, diff_threshold: float = 8.0, thumbnail_size: int = 32):
+        """
+        Args:
+            hash_threshold (int): Maximum number of differing dHash bits (out of 64).
+            diff_threshold (float): Maximum mean absolute difference of the thumbnails (0-255).
+            thumbnail_size (int): Side of the square grayscale thumbnail used for diffing.
+        """
+        self.hash_threshold = hash_threshold
+        self.diff_threshold = diff_threshold
+        self.thumbnail_size = thumbnail_size
+        self.reference = None  # Signature of the last committed frame
+
+    def signature(self, frame):
+        """
+        Computes the (dhash, thumbnail) signature of a BGR frame.
+
+        The signature owns its data, so the frame may be reused right afterwards.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        thumbnail = cv2.resize(gray, (self.thumbnail_size, self.thumbnail_size), interpolation=cv2.INTER_AREA)
+
+        # dHash: compare horizontally adjacent pixels of a 9x8 downscale
+        small = cv2.resize(thumbnail, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = (small[:, 1:] > small[:, :-1]).flatten()
+        dhash = int(np.packbits(bits).view(">u8")[0])
+
+        return dhash, thumbnail
+
+    def distance(self, signature, other):
+        """
+        Returns:
+            tuple: (differing hash bits, mean absolute thumbnail difference)
+        """
+        hash_bits = bin(signature[0] ^ other[0]).count("1")
+        mean_diff = float(cv2.absdiff(signature[1], other[1]).mean())
+        return hash_bits, mean_diff
+
+    def is_unchanged(self, signature) -> bool:
+        """True if `signature` is within the thresholds of the committed reference."""
+        if self.reference is None:
+            return False
+        hash_bits, mean_diff = self.distance(signature, self.reference)
+        return hash_bits <= self.hash_threshold and mean_diff <= self.diff_threshold
+
+    def commit(self, signature):
+        """Makes `signature` the reference, e.g. once a step using that frame completed."""
+        self.reference = signature
+
+    def reset(self):
+        """Forgets the reference so the next frame always counts as changed."""
+        self.reference = None
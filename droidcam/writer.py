@@ -0,0 +1,125 @@
+import datetime
+import os
+import queue
+import threading
+from enum import Enum
+
+import cv2
+import numpy as np
+
+
+class ImageFormat(Enum):
+    PNG = "png"
+    JPEG = "jpg"
+    WEBP = "webp"
+
+
+class Backpressure(Enum):
+    DROP = 0  # Drop new snapshots while the queue is full
+    BLOCK = 1  # Block the caller until there is room in the queue
+
+
+class SnapshotWriter:
+    """
+    Persists snapshots to disk from a dedicated background thread.
+
+    Callers hand over either a raw frame or already encoded bytes and return immediately;
+    encoding (if still needed) and file I/O happen off the caller's critical path.
+    """
+
+    def __init__(self, directory, image_format=ImageFormat.JPEG, quality: int = 90, max_queue: int = 8,
+                 backpressure=Backpressure.DROP, log=print):
+        """
+        Args:
+            directory (str): Directory the snapshots are written to.
+            image_format (ImageFormat): Format of the files on disk.
+            quality (int): JPEG/WebP quality (0-100). PNG is always lossless.
+            max_queue (int): Maximum number of snapshots waiting to be written.
+            backpressure (Backpressure): What `submit` does when the queue is full.
+            log (callable): Function used to report saved files and errors.
+        """
+        self.directory = directory
+        self.image_format = image_format
+        self.quality = quality
+        self.backpressure = backpressure
+        self.dropped = 0  # Number of snapshots dropped because the queue was full
+        self._log = log
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread.start()
+
+    def submit(self, frame=None, data: bytes = None, data_format=ImageFormat.JPEG, rgb: bool = False,
+               timeout: float = None) -> bool:
+        """
+        Queues a snapshot for writing.
+
+        Args:
+            frame (numpy.ndarray, optional): Frame to encode. Must not be modified afterwards.
+            data (bytes, optional): Already encoded image. Written as-is when it matches
+                                    the writer's format, so nothing is encoded twice.
+            data_format (ImageFormat): Format of `data`.
+            rgb (bool): True if `frame` is RGB rather than OpenCV's BGR.
+            timeout (float, optional): Maximum blocking time with Backpressure.BLOCK.
+
+        Returns:
+            bool: True if the snapshot was queued, False if it was dropped.
+        """
+        if frame is None and data is None:
+            raise ValueError("Either frame or data must be given")
+
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        item = (timestamp, frame, data, data_format, rgb)
+        try:
+            if self.backpressure == Backpressure.BLOCK:
+                self._queue.put(item, timeout=timeout)
+            else:
+                self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self, timeout: float = 5.0):
+        """Writes out the queued snapshots and stops the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._write(*item)
+            except Exception as e:
+                self._log(f"Error saving snapshot: {e}")
+
+    def _write(self, timestamp, frame, data, data_format, rgb):
+        filename = os.path.join(self.directory, f"snapshot_{timestamp}.{self.image_format.value}")
+
+        if data is None or data_format != self.image_format:
+            if frame is None:
+                frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            elif rgb:
+                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+            data = self._encode(frame)
+
+        with open(filename, "wb") as f:
+            f.write(data)
+        self._log(f"Snapshot saved to {filename}")
+
+    def _encode(self, frame) -> bytes:
+        if self.image_format == ImageFormat.JPEG:
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        elif self.image_format == ImageFormat.WEBP:
+            params = [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        else:
+            params = [cv2.IMWRITE_PNG_COMPRESSION, 1]  # Lossless either way, favour speed
+
+        ok, buffer = cv2.imencode(f".{self.image_format.value}", frame, params)
+        if not ok:
+            raise ValueError(f"Could not encode snapshot as {self.image_format.name}")
+        return buffer.tobytes()
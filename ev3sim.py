@@ -0,0 +1,352 @@
+"""
+Simulated ev3dev2 motors, sound and power supply, so server.py runs without a brick
+(`python server.py --sim`), e.g. to load-test the command server on a Linux box.
+
+The stand-ins mirror the parts of the ev3dev2 API used by server.py and keep real time:
+
+- Motors switch speed instantly (ev3dev's default ramp of 0), `on_for_seconds` and
+  `on_for_degrees` run exactly as long as on the brick and the tacho counts advance
+  with the speed (1050 deg/s at 100 % for large motors, 1560 deg/s for medium motors).
+- MoveTank integrates the wheel travel into a 2D pose, see `MoveTank.pose`.
+- Sound returns Popen-like handles that finish when the sound would: espeak speech takes
+  its words-per-minute rate, WAV files their length and beeps their length.
+- `set_time_scale` speeds the simulated clock up, e.g. for replays at a multiple of real time.
+
+Written for the brick's Python 3.5 like server.py, so no f-strings here.
+"""
+
+import math
+import threading
+import time
+import wave
+
+OUTPUT_A = "outA"
+OUTPUT_B = "outB"
+OUTPUT_C = "outC"
+OUTPUT_D = "outD"
+
+# How often blocking waits check the simulated motors, in real seconds
+POLL_INTERVAL = 0.01
+
+# Real seconds per simulated second, see set_time_scale
+_time_scale = 1.0
+
+# Standard EV3 tire and the axle track of the robot, see Odometry in llm_agent/ev3/telemetry.py
+WHEEL_DIAMETER = 56.0
+AXLE_TRACK = 120.0
+
+
+def set_time_scale(scale):
+    """Makes every simulated second take `scale` real seconds. Call before anything is simulated."""
+    global _time_scale
+    if scale <= 0:
+        raise ValueError("The time scale must be positive")
+    _time_scale = scale
+
+
+def clock():
+    """Simulated time in seconds, time.monotonic() unless the time is scaled."""
+    return time.monotonic() / _time_scale
+
+
+def sleep(seconds):
+    """Sleeps for `seconds` of simulated time."""
+    time.sleep(seconds * _time_scale)
+
+
+class SpeedPercent(object):
+    """Speed as a percentage of the motor's maximum speed."""
+
+    def __init__(self, percent):
+        if not -100 <= percent <= 100:
+            raise ValueError(str(percent) + " is an invalid percentage, must be between -100 and 100 (inclusive)")
+        self.percent = percent
+
+    def to_native_units(self, motor):
+        return self.percent / 100.0 * motor.max_speed
+
+
+def _native_speed(speed, motor):
+    """Degrees per second of `speed`, a SpeedPercent or a plain percentage like in ev3dev2."""
+    if not hasattr(speed, "to_native_units"):
+        speed = SpeedPercent(speed)
+    return speed.to_native_units(motor)
+
+
+class Motor(object):
+    """
+    Tacho motor. The position is computed from the current run (start position, start
+    time, speed and end time), so no background thread is needed and reads are exact.
+    """
+
+    MAX_SPEED = 1050  # Degrees per second at 100 %
+
+    def __init__(self, address=None):
+        self.address = address
+        self.max_speed = self.MAX_SPEED
+        self.count_per_rot = 360
+        self._lock = threading.Lock()
+        self._origin = 0.0  # Position at _since
+        self._since = clock()
+        self._speed = 0.0  # Degrees per second of the current run
+        self._until = None  # clock() at which the current run ends, None runs until off()
+
+    def _end(self, now):
+        return now if self._until is None else min(now, self._until)
+
+    def _position(self, now):
+        return self._origin + self._speed * (self._end(now) - self._since)
+
+    def _running(self, now):
+        return self._speed != 0 and (self._until is None or now < self._until)
+
+    def _run(self, speed, duration=None):
+        """Starts a run at `speed` degrees per second, for `duration` seconds or until changed."""
+        with self._lock:
+            now = clock()
+            self._origin = self._position(now)
+            self._since = now
+            self._speed = float(speed)
+            self._until = None if duration is None else now + duration
+
+    def position_at(self, now):
+        """Exact (fractional) tacho count at clock() `now`."""
+        with self._lock:
+            return self._position(now)
+
+    @property
+    def position(self):
+        return int(round(self.position_at(clock())))
+
+    @property
+    def speed(self):
+        with self._lock:
+            return int(round(self._speed)) if self._running(clock()) else 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return ["running"] if self._running(clock()) else []
+
+    @property
+    def is_running(self):
+        return "running" in self.state
+
+    def on(self, speed, brake=True, block=False):
+        self._run(_native_speed(speed, self))
+
+    def off(self, brake=True):
+        self._run(0)
+
+    def on_for_seconds(self, speed, seconds, brake=True, block=True):
+        self._run(_native_speed(speed, self), seconds)
+        if block:
+            self.wait_until_not_moving()
+
+    def on_for_degrees(self, speed, degrees, brake=True, block=True):
+        speed = _native_speed(speed, self)
+        if speed == 0 or degrees == 0:
+            self.off()
+            return
+        # Like ev3dev2, the signs of speed and degrees together give the direction
+        direction = 1 if (speed > 0) == (degrees > 0) else -1
+        self._run(direction * abs(speed), abs(degrees) / abs(speed))
+        if block:
+            self.wait_until_not_moving()
+
+    def on_for_rotations(self, speed, rotations, brake=True, block=True):
+        self.on_for_degrees(speed, rotations * self.count_per_rot, brake, block)
+
+    def wait_until_not_moving(self, timeout=None):
+        """Returns True once the motor stopped, False if `timeout` (in ms, like ev3dev2) passed first."""
+        deadline = None if timeout is None else clock() + timeout / 1000.0
+        while self.is_running:
+            if deadline is not None and clock() >= deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+
+class LargeMotor(Motor):
+    MAX_SPEED = 1050
+
+
+class MediumMotor(Motor):
+    MAX_SPEED = 1560
+
+
+class MoveTank(object):
+    """
+    Two large motors driven together. Keeps a pose (x, y in mm, heading in degrees
+    counterclockwise, distance driven in mm) integrated from the wheel travel, using the
+    conventions of server.py: negative speeds drive forward.
+    """
+
+    def __init__(self, left_motor_port, right_motor_port, desc=None, motor_class=LargeMotor,
+                 wheel_diameter=WHEEL_DIAMETER, axle_track=AXLE_TRACK):
+        self.left_motor = motor_class(left_motor_port)
+        self.right_motor = motor_class(right_motor_port)
+        self.mm_per_degree = math.pi * wheel_diameter / 360
+        self.axle_track = axle_track
+        self._pose_lock = threading.Lock()
+        self._pose = (0.0, 0.0, 0.0, 0.0)
+        self._positions = (0, 0)
+
+    def _integrate(self):
+        """
+        Advances the pose to the current tacho counts. Called before every speed change,
+        so the wheel speeds were constant since the last call and the path is an exact arc.
+        """
+        with self._pose_lock:
+            now = clock()
+            positions = (self.left_motor.position_at(now), self.right_motor.position_at(now))
+            left = -(positions[0] - self._positions[0]) * self.mm_per_degree
+            right = -(positions[1] - self._positions[1]) * self.mm_per_degree
+            self._positions = positions
+
+            x, y, heading, distance = self._pose
+            forward = (left + right) / 2
+            turn = (left - right) / self.axle_track  # Radians, counterclockwise
+            if abs(turn) < 1e-9:
+                x += forward * math.cos(heading)
+                y += forward * math.sin(heading)
+            else:
+                radius = forward / turn
+                x += radius * (math.sin(heading + turn) - math.sin(heading))
+                y -= radius * (math.cos(heading + turn) - math.cos(heading))
+            self._pose = (x, y, heading + turn, distance + abs(forward))
+
+    @property
+    def pose(self):
+        """(x, y, heading, distance) since the start, in mm and degrees within [-180, 180)."""
+        self._integrate()
+        x, y, heading, distance = self._pose
+        return x, y, (math.degrees(heading) + 180) % 360 - 180, distance
+
+    @property
+    def is_running(self):
+        return self.left_motor.is_running or self.right_motor.is_running
+
+    def _run(self, left_speed, right_speed, duration=None):
+        self._integrate()
+        self.left_motor._run(left_speed, duration)
+        self.right_motor._run(right_speed, duration)
+
+    def on(self, left_speed, right_speed):
+        self._run(_native_speed(left_speed, self.left_motor), _native_speed(right_speed, self.right_motor))
+
+    def off(self, motors=None, brake=True):
+        self._run(0, 0)
+
+    def on_for_seconds(self, left_speed, right_speed, seconds, brake=True, block=True):
+        self._run(_native_speed(left_speed, self.left_motor), _native_speed(right_speed, self.right_motor), seconds)
+        if block:
+            self.wait_until_not_moving()
+
+    def on_for_degrees(self, left_speed, right_speed, degrees, brake=True, block=True):
+        """Like ev3dev2: the faster motor turns `degrees`, the slower one proportionally less."""
+        left = _native_speed(left_speed, self.left_motor)
+        right = _native_speed(right_speed, self.right_motor)
+        fastest = max(abs(left), abs(right))
+        if fastest == 0 or degrees == 0:
+            self.off()
+            return
+        direction = 1 if degrees > 0 else -1
+        self._run(direction * left, direction * right, abs(degrees) / fastest)
+        if block:
+            self.wait_until_not_moving()
+
+    def on_for_rotations(self, left_speed, right_speed, rotations, brake=True, block=True):
+        self.on_for_degrees(left_speed, right_speed, rotations * 360, brake, block)
+
+    def wait_until_not_moving(self, timeout=None):
+        return self.left_motor.wait_until_not_moving(timeout) and self.right_motor.wait_until_not_moving(timeout)
+
+
+class SimulatedProcess(object):
+    """Popen-like handle of a simulated sound that ends `duration` seconds after it started."""
+
+    def __init__(self, duration, returncode=0):
+        self.args = None
+        self._end = clock() + duration
+        self._returncode = returncode
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None and clock() >= self._end:
+            self.returncode = self._returncode
+        return self.returncode
+
+    def wait(self, timeout=None):
+        remaining = self._end - clock()
+        if timeout is not None and remaining > timeout:
+            sleep(timeout)
+            return self.poll()
+        sleep(max(0, remaining))
+        return self.poll()
+
+    def terminate(self):
+        if self.returncode is None:
+            self.returncode = -15
+
+    kill = terminate
+
+
+class Sound(object):
+    """Times sounds like the brick would play them, without making any noise."""
+
+    PLAY_WAIT_FOR_COMPLETE = 0
+    PLAY_NO_WAIT_FOR_COMPLETE = 1
+    PLAY_LOOP = 2
+
+    BEEP_SECONDS = 0.2  # Default length of the `beep` tool
+    ESPEAK_STARTUP = 0.15  # espeak loads its voice before it starts talking
+    ESPEAK_WORDS_PER_MINUTE = 175  # espeak's default for `-s`
+    APLAY_STARTUP = 0.05
+
+    def _play(self, duration, play_type, returncode=0):
+        process = SimulatedProcess(duration, returncode)
+        if play_type == Sound.PLAY_WAIT_FOR_COMPLETE:
+            process.wait()
+            return None
+        return process
+
+    def beep(self, args="", play_type=PLAY_WAIT_FOR_COMPLETE):
+        beeps = max(1, args.count("-n") + 1)
+        return self._play(beeps * self.BEEP_SECONDS, play_type)
+
+    def speak(self, text, espeak_opts="-a 200 -s 130", volume=100, play_type=PLAY_WAIT_FOR_COMPLETE):
+        return self._play(self.speech_duration(text, espeak_opts), play_type)
+
+    def play_file(self, wav_file, volume=100, play_type=PLAY_WAIT_FOR_COMPLETE):
+        try:
+            duration = wav_duration(wav_file)
+        except (OSError, EOFError, wave.Error):
+            return self._play(self.APLAY_STARTUP, play_type, returncode=1)  # aplay fails right away
+        return self._play(self.APLAY_STARTUP + duration, play_type)
+
+    @classmethod
+    def speech_duration(cls, text, espeak_opts=""):
+        """Seconds espeak takes to say `text` with the words-per-minute rate of `-s` in `espeak_opts`."""
+        options = espeak_opts.split()
+        rate = cls.ESPEAK_WORDS_PER_MINUTE
+        if "-s" in options and options.index("-s") + 1 < len(options):
+            rate = float(options[options.index("-s") + 1])
+        return cls.ESPEAK_STARTUP + 60.0 * len(text.split()) / rate
+
+
+def wav_duration(path):
+    """Length of a WAV file in seconds."""
+    with wave.open(path, "rb") as wav:
+        return wav.getnframes() / float(wav.getframerate())
+
+
+class PowerSupply(object):
+    """A fresh battery pack of 6 AA cells."""
+
+    def __init__(self, volts=8.2):
+        self.volts = volts
+
+    @property
+    def measured_volts(self):
+        return self.volts
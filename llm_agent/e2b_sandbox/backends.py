@@ -0,0 +1,279 @@
+import ast
+import json
+import os
+import selectors
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from typing import Callable, Optional
+
+from e2b_code_interpreter import TimeoutException
+
+from .pool import SandboxPool
+
+# Outcome of running code. `text` is the value of the trailing expression (None if there is none),
+# `error` is "<ExceptionName>: <message>" if the code raised.
+ExecutionResult = namedtuple("ExecutionResult", ["text", "stdout", "stderr", "error"])
+
+# Modules the local backend has available; code importing anything else goes to E2B
+LOCAL_MODULES = {"math", "cmath", "decimal", "fractions", "statistics", "itertools", "functools",
+                 "operator", "collections", "string", "re", "datetime", "random", "time"}
+# Builtins which do not fit the "short pure computation" profile of the local backend
+NON_LOCAL_BUILTINS = {"open", "input", "exec", "eval", "compile", "__import__", "breakpoint"}
+MAX_LOCAL_CODE_LENGTH = 2000
+# The only environment variables local workers get, so secrets like OPEN_AI_KEY stay out of reach
+WORKER_ENVIRONMENT = {"PATH": os.defpath, "LANG": "C.UTF-8"}
+
+# Receives output of the running code as it is produced
+OutputCallback = Callable[[str], None]
+
+
+class ExecutionBackend(ABC):
+    """
+    Runs Python code for ExecutePythonFunction.
+    """
+
+    @abstractmethod
+    def run(self, code: str, timeout: Optional[float] = None, on_stdout: Optional[OutputCallback] = None,
+            on_stderr: Optional[OutputCallback] = None) -> ExecutionResult:
+        """
+        Runs `code` like a notebook cell and returns its result.
+
+        Args:
+            code: The code to run.
+            timeout: Wall-clock limit in seconds, the backend's default if None. Code running
+                     longer is cancelled and the result has a TimeoutError.
+            on_stdout: Called with stdout output while the code runs.
+            on_stderr: Called with stderr output while the code runs.
+        """
+        pass
+
+    @property
+    def stateful(self) -> bool:
+        """True if runs share kernel state, so the result of code can depend on earlier runs."""
+        return False
+
+    def close(self):
+        """Releases the resources of the backend."""
+        pass
+
+
+class E2BBackend(ExecutionBackend):
+    """
+    Runs code in E2B sandboxes leased from a SandboxPool.
+    """
+
+    def __init__(self, pool: Optional[SandboxPool] = None, session: Optional[str] = None, timeout: float = 30.0):
+        """
+        Args:
+            pool: Pool to lease sandboxes from, a new pool by default.
+            session: Run all code in the persistent sandbox of this session.
+            timeout: Default wall-clock limit of a run in seconds.
+        """
+        self.pool = pool if pool is not None else SandboxPool()
+        self.session = session
+        self.timeout = timeout
+
+    def run(self, code, timeout=None, on_stdout=None, on_stderr=None) -> ExecutionResult:
+        try:
+            # Raising out of the lease shuts the sandbox down, which also stops the code
+            with self.pool.lease(self.session) as (sandbox, context):
+                execution = sandbox.run_code(code, context=context, timeout=timeout or self.timeout,
+                                             on_stdout=on_stdout and (lambda message: on_stdout(message.line)),
+                                             on_stderr=on_stderr and (lambda message: on_stderr(message.line)))
+        except TimeoutException:
+            return ExecutionResult(None, "", "", f"TimeoutError: Execution took longer than {timeout or self.timeout} s")
+
+        error = f"{execution.error.name}: {execution.error.value}" if execution.error else None
+        return ExecutionResult(text=execution.text,
+                               stdout="".join(execution.logs.stdout),
+                               stderr="".join(execution.logs.stderr),
+                               error=error)
+
+    @property
+    def stateful(self) -> bool:
+        return self.session is not None
+
+    def close(self):
+        self.pool.close()
+
+
+class LocalBackend(ExecutionBackend):
+    """
+    Runs code in local worker processes (see local_worker.py).
+
+    Workers are started ahead of time, so a run does not wait for the interpreter to
+    start, and each worker runs a single piece of code, so nothing leaks between runs.
+    Workers get an empty temporary working directory and a minimal environment without
+    the host's secrets. CPU time, memory and file sizes are capped with rlimits; network
+    access, processes and modifying or deleting files are blocked by the worker's audit hook.
+    """
+
+    WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_worker.py")
+
+    def __init__(self, workers: int = 2, timeout: float = 10.0, cpu_seconds: int = 5,
+                 memory_bytes: int = 512 * 1024 * 1024, max_output: int = 64 * 1024):
+        """
+        Args:
+            workers: Number of worker processes kept ready.
+            timeout: Default wall-clock limit of a run in seconds.
+            cpu_seconds: CPU time limit of a run in seconds.
+            memory_bytes: Address space limit of a worker in bytes.
+            max_output: Characters of stdout and stderr each kept per run, the rest is dropped.
+        """
+        self.workers = workers
+        self.timeout = timeout
+        self.max_output = max_output
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self._lock = threading.Lock()
+        self._ready = [self._spawn() for _ in range(workers)]
+
+    def _spawn(self) -> subprocess.Popen:
+        # Popen returns right after fork/exec, the interpreter starts up in the background. No preexec_fn:
+        # running Python between fork and exec can deadlock in a process with this many threads, so the
+        # worker sets its resource limits itself before it reads a request.
+        directory = tempfile.mkdtemp(prefix="local-worker-")
+        command = [sys.executable, "-I", "-B", self.WORKER, str(self.cpu_seconds), str(self.memory_bytes)]
+        worker = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                  cwd=directory, env=WORKER_ENVIRONMENT, start_new_session=True)
+        worker.directory = directory
+        return worker
+
+    @staticmethod
+    def _discard(worker: subprocess.Popen):
+        worker.kill()
+        worker.wait()
+        shutil.rmtree(worker.directory, ignore_errors=True)
+
+    def run(self, code, timeout=None, on_stdout=None, on_stderr=None) -> ExecutionResult:
+        timeout = timeout or self.timeout
+        with self._lock:
+            worker = self._ready.pop(0) if self._ready else self._spawn()
+            self._ready.append(self._spawn())
+
+        output = {"stdout": [], "stderr": []}
+        callbacks = {"stdout": on_stdout, "stderr": on_stderr}
+        reply = None
+        try:
+            worker.stdin.write((json.dumps({"code": code, "max_output": self.max_output}) + "\n").encode())
+            worker.stdin.close()
+            for message in self._read_messages(worker, time.monotonic() + timeout):
+                if "stream" in message:
+                    output[message["stream"]].append(message["data"])
+                    if callbacks[message["stream"]] is not None:
+                        callbacks[message["stream"]](message["data"])
+                else:
+                    reply = message
+        except TimeoutError:
+            reply = {"text": None, "error": f"TimeoutError: Execution took longer than {timeout} s"}
+        except (OSError, ValueError):
+            pass  # The worker died, handled below
+        finally:
+            self._discard(worker)
+
+        if reply is None:
+            if worker.returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+                reply = {"text": None, "error": f"TimeoutError: CPU time limit of {self.cpu_seconds} s exceeded"}
+            else:
+                reply = {"text": None, "error": f"RuntimeError: Worker exited with code {worker.returncode}"}
+        return ExecutionResult(reply["text"], "".join(output["stdout"]), "".join(output["stderr"]), reply["error"])
+
+    @staticmethod
+    def _read_messages(worker: subprocess.Popen, deadline: float):
+        """Yields the JSON lines the worker writes until it exits. Raises TimeoutError at `deadline`."""
+        with selectors.DefaultSelector() as selector:
+            selector.register(worker.stdout, selectors.EVENT_READ)
+            buffer = b""
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError()
+                if not selector.select(remaining):
+                    continue
+                data = os.read(worker.stdout.fileno(), 65536)
+                if not data:
+                    return
+                *lines, buffer = (buffer + data).split(b"\n")
+                for line in lines:
+                    yield json.loads(line)
+
+    def close(self):
+        with self._lock:
+            ready, self._ready = self._ready, []
+        for worker in ready:
+            self._discard(worker)
+
+
+def prefers_local(code: str) -> bool:
+    """
+    Routing policy: short code that only needs the stdlib modules of the local
+    backend (typically arithmetic) runs locally, everything else in E2B.
+    """
+    if len(code) > MAX_LOCAL_CODE_LENGTH:
+        return False
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return True  # Fails the same way everywhere, fail fast
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules = [node.module or ""]
+        elif isinstance(node, ast.Name) and node.id in NON_LOCAL_BUILTINS:
+            return False
+        else:
+            continue
+        if any(module.split(".")[0] not in LOCAL_MODULES for module in modules):
+            return False
+    return True
+
+
+class RoutingBackend(ExecutionBackend):
+    """
+    Picks the local or the remote backend per run.
+
+    Only code the policy accepts ever runs locally: without a remote backend (e.g. no
+    E2B_API_KEY) other code is refused, and when the remote backend fails for
+    infrastructure reasons only code the policy accepts falls back to local.
+    """
+
+    def __init__(self, local: ExecutionBackend, remote: Optional[ExecutionBackend] = None,
+                 policy: Callable[[str], bool] = prefers_local):
+        self.local = local
+        self.remote = remote
+        self.policy = policy
+
+    def run(self, code, timeout=None, on_stdout=None, on_stderr=None) -> ExecutionResult:
+        if self.policy(code):
+            return self.local.run(code, timeout, on_stdout, on_stderr)
+        if self.remote is None:
+            return ExecutionResult(None, "", "", "RuntimeError: This code needs the E2B sandbox, which is not "
+                                                 "configured (E2B_API_KEY). Only short stdlib computations run locally.")
+        try:
+            return self.remote.run(code, timeout, on_stdout, on_stderr)
+        except Exception as e:
+            print(f"Remote execution failed ({e})")
+            return ExecutionResult(None, "", "", f"RuntimeError: Remote execution failed: {e}")
+
+    @property
+    def stateful(self) -> bool:
+        return self.local.stateful or (self.remote is not None and self.remote.stateful)
+
+    def close(self):
+        self.local.close()
+        if self.remote is not None:
+            self.remote.close()
+
+
+def default_backend() -> ExecutionBackend:
+    """Local fast path, plus E2B if an API key is configured."""
+    remote = E2BBackend() if os.environ.get("E2B_API_KEY") else None
+    return RoutingBackend(LocalBackend(), remote)
@@ -0,0 +1,199 @@
+import ast
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from .backends import ExecutionBackend, ExecutionResult
+
+# Code importing one of these can return something else on every run
+NON_DETERMINISTIC_MODULES = {"random", "time", "datetime", "secrets", "uuid", "os", "numpy.random"}
+# Methods reading the clock on any object, e.g. pd.Timestamp.now() or date.today()
+NON_DETERMINISTIC_ATTRIBUTES = {"now", "today", "utcnow"}
+NO_CACHE_MARKER = "# nocache"
+
+
+def normalize_code(code: str) -> str:
+    """
+    Canonical form of `code`: comments, blank lines and formatting differences are
+    removed, so code that differs only in those maps to the same cache key.
+    """
+    try:
+        return ast.unparse(ast.parse(code))
+    except SyntaxError:
+        lines = (line.split("#", 1)[0].rstrip() for line in code.splitlines())
+        return "\n".join(line for line in lines if line.strip())
+
+
+def is_deterministic(code: str) -> bool:
+    """
+    False for code marked with `# nocache` or using a source of randomness or time, either
+    imported (`from numpy import random`), through an alias (`np.random.rand()`) or via a
+    clock reading method (`pd.Timestamp.now()`).
+    """
+    if NO_CACHE_MARKER in code:
+        return False
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return True
+
+    aliases = {}  # Name bound by an import -> dotted name of what it refers to
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if _is_non_deterministic(alias.name):
+                    return False
+                if alias.asname:
+                    aliases[alias.asname] = alias.name
+        elif isinstance(node, ast.ImportFrom):
+            module = node.module or ""
+            for alias in node.names:
+                if _is_non_deterministic(module) or _is_non_deterministic(f"{module}.{alias.name}"):
+                    return False
+                aliases[alias.asname or alias.name] = f"{module}.{alias.name}"
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute):
+            if node.attr in NON_DETERMINISTIC_ATTRIBUTES:
+                return False
+            name = _dotted_name(node, aliases)
+            if name is not None and _is_non_deterministic(name):
+                return False
+    return True
+
+
+def _is_non_deterministic(name: str) -> bool:
+    """True if dotted `name` is, or is inside, one of NON_DETERMINISTIC_MODULES."""
+    parts = name.split(".")
+    return any(".".join(parts[:length]) in NON_DETERMINISTIC_MODULES for length in range(1, len(parts) + 1))
+
+
+def _dotted_name(node: ast.Attribute, aliases: dict) -> Optional[str]:
+    """"np.random.rand" for the attribute chain `np.random.rand` with np resolved to numpy, None for other chains."""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(aliases.get(node.id, node.id))
+    return ".".join(reversed(parts))
+
+
+class ResultCache:
+    """
+    LRU cache of execution results keyed on normalized code, with a TTL.
+
+    With a `path`, entries are appended to a JSON lines file and loaded again on
+    startup, so results survive restarts.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 24 * 3600.0, path: Optional[str] = None):
+        """
+        Args:
+            max_entries: Maximum number of cached results.
+            ttl: Seconds after which a result is run again.
+            path: JSON lines file to persist the cache in, or None to keep it in memory only.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()  # key -> (time.time() when stored, ExecutionResult), oldest first
+        self._lock = threading.Lock()
+        if path is not None:
+            self._load()
+
+    @staticmethod
+    def key(code: str) -> str:
+        return hashlib.sha256(normalize_code(code).encode()).hexdigest()
+
+    def get(self, code: str) -> Optional[ExecutionResult]:
+        key = self.key(code)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, code: str, result: ExecutionResult):
+        key = self.key(code)
+        stored = time.time()
+        with self._lock:
+            self._entries[key] = (stored, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.path is not None:
+                with open(self.path, "a") as file:
+                    file.write(json.dumps({"key": key, "stored": stored, "result": result._asdict()}) + "\n")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self.path is not None and os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _load(self):
+        """Reads the persisted entries and rewrites the file without expired or evicted ones."""
+        if not os.path.exists(self.path):
+            return
+        now = time.time()
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                    result = ExecutionResult(**entry["result"])
+                except (ValueError, KeyError, TypeError):
+                    continue  # E.g. a line cut short by a crash
+                if now - entry["stored"] <= self.ttl:
+                    self._entries.pop(entry["key"], None)
+                    self._entries[entry["key"]] = (entry["stored"], result)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            for key, (stored, result) in self._entries.items():
+                file.write(json.dumps({"key": key, "stored": stored, "result": result._asdict()}) + "\n")
+        os.replace(temporary, self.path)
+
+
+class CachingBackend(ExecutionBackend):
+    """
+    Returns the cached result for code that already ran successfully, so solving the
+    same problem again does not run anything. Non-deterministic code is always run, and
+    so is all code of a stateful backend (a session), whose results depend on earlier runs.
+    """
+
+    def __init__(self, backend: ExecutionBackend, cache: Optional[ResultCache] = None):
+        self.backend = backend
+        self.cache = cache if cache is not None else ResultCache()
+
+    def run(self, code, timeout=None, on_stdout=None, on_stderr=None) -> ExecutionResult:
+        cacheable = not self.backend.stateful and is_deterministic(code)
+        if cacheable:
+            result = self.cache.get(code)
+            if result is not None:
+                # Streaming callers still get the output, all at once
+                if on_stdout is not None and result.stdout:
+                    on_stdout(result.stdout)
+                if on_stderr is not None and result.stderr:
+                    on_stderr(result.stderr)
+                return result
+
+        result = self.backend.run(code, timeout, on_stdout, on_stderr)
+        # Errors may be transient (timeouts, lost sandboxes), run such code again next time
+        if cacheable and result.error is None:
+            self.cache.put(code, result)
+        return result
+
+    def close(self):
+        self.backend.close()
@@ -1,7 +1,10 @@
 from ..functions import BaseFunction
+from .backends import ExecutionBackend, ExecutionResult, default_backend
+from .cache import CachingBackend
+from tracing.core import span
 
-from e2b_code_interpreter import Sandbox
 from dotenv import load_dotenv
+from typing import Optional
 import json
 
 load_dotenv()
@@ -10,10 +13,21 @@ load_dotenv()
 class ExecutePythonFunction(BaseFunction):
     """
     Function to execute Python code in a sandbox.
+
+    The code runs on an ExecutionBackend; by default short stdlib-only code runs in
+    local worker processes and everything else in pooled E2B sandboxes, and results
+    of code that already ran are reused.
+
+    Output is printed while the code runs, and the result returned to the model is
+    capped at `max_output_bytes`.
     """
 
-    def __init__(self, robot):
+    def __init__(self, robot, backend: Optional[ExecutionBackend] = None, timeout: float = 30.0,
+                 max_output_bytes: int = 2000):
         self.robot = robot
+        self.backend = backend if backend is not None else CachingBackend(default_backend())
+        self.timeout = timeout  # Seconds before runaway code is cancelled
+        self.max_output_bytes = max_output_bytes
 
     function_schema = {
         "type": "function",
@@ -40,14 +54,53 @@ class ExecutePythonFunction(BaseFunction):
         self.robot.beep()
 
         print(f"Executing the code: {code}")
-        with Sandbox() as sandbox:
-            execution = sandbox.run_code(code)
-            result = execution.text
+        with span("execute.run") as run_span:
+            execution = self.backend.run(code, timeout=self.timeout,
+                                         on_stdout=lambda data: _print_output("stdout", data),
+                                         on_stderr=lambda data: _print_output("stderr", data))
+            run_span.set(error=execution.error)
+        result = format_result(execution, self.max_output_bytes)
 
         print(f"Execution: {result}")
 
         return result
 
+
+def _print_output(stream: str, data: str):
+    print("".join(f"[{stream}] {line}" for line in data.splitlines(keepends=True)), end="")
+
+
+def truncate(text: str, max_bytes: int) -> str:
+    """Cuts the middle out of `text` so its UTF-8 encoding fits into about `max_bytes`."""
+    data = text.encode()
+    if len(data) <= max_bytes:
+        return text
+    head = data[:max_bytes * 2 // 3].decode(errors="ignore")
+    tail = data[len(data) - max_bytes // 3:].decode(errors="ignore")
+    return f"{head}\n[... {len(data) - max_bytes} bytes truncated ...]\n{tail}"
+
+
+def format_result(execution: ExecutionResult, max_bytes: int) -> str:
+    """
+    Describes an execution for the model: printed output, the value of the last
+    expression and the error, within `max_bytes`.
+    """
+    parts = []
+    if execution.stdout.strip():
+        parts.append(execution.stdout.rstrip())
+    if execution.text is not None:
+        parts.append(execution.text)
+    if execution.error is not None:
+        # The end of the traceback says where it failed
+        traceback = execution.stderr.rstrip().splitlines()[-6:]
+        if traceback and traceback[-1] == execution.error:
+            parts.append("Error:\n" + "\n".join(traceback))
+        else:
+            parts.append(f"Error: {execution.error}")
+    if not parts:
+        return "The code ran without output."
+    return truncate("\n".join(parts), max_bytes)
+
 import random
 
 
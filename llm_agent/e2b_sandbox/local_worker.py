@@ -0,0 +1,128 @@
+"""
+Worker process of LocalBackend. Started ahead of time with
+`python -I local_worker.py <cpu seconds> <memory bytes>`, it applies these resource
+limits, reads one JSON request {"code": ..., "max_output": ...} from stdin and runs
+the code. Output of the code is streamed as JSON lines {"stream": "stdout" | "stderr",
+"data": ...} while it runs, up to `max_output` characters per stream; finally one JSON
+reply {"text", "error"} is written and the worker exits.
+
+Like a notebook cell, the value of a trailing expression is returned as "text".
+Network access, starting processes and creating, modifying or deleting files are
+blocked with an audit hook; this is a guard against accidents, not a security boundary
+(reading files stays possible, the resource limits are what bounds runaway code).
+"""
+
+import ast
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import traceback
+
+# Imported before the audit hook is installed, so the first request does not pay for it
+import cmath  # noqa: F401
+import decimal  # noqa: F401
+import fractions  # noqa: F401
+import math  # noqa: F401
+import statistics  # noqa: F401
+
+BLOCKED_EVENTS = {"socket.__new__", "socket.connect", "socket.bind", "socket.getaddrinfo",
+                  "subprocess.Popen", "os.system", "os.exec", "os.posix_spawn", "os.fork", "os.forkpty",
+                  "os.remove", "os.rename", "os.rmdir", "os.mkdir", "os.truncate", "os.chmod", "os.chown",
+                  "os.link", "os.symlink", "os.utime", "shutil.rmtree", "shutil.move", "shutil.copyfile"}
+WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_APPEND
+
+
+def limit_resources(cpu_seconds, memory_bytes):
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))  # SIGXCPU, then SIGKILL
+    resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))  # Writes fail; opening for writing is blocked anyway
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+
+def _audit(event, args):
+    if event in BLOCKED_EVENTS:
+        raise PermissionError(f"{event} is not allowed in the local sandbox")
+    if event == "open":
+        path, mode, flags = args
+        if (mode is not None and any(c in mode for c in "wax+")) or flags & WRITE_FLAGS:
+            raise PermissionError(f"Writing {path} is not allowed in the local sandbox")
+
+
+class _Stream(io.TextIOBase):
+    """Forwards complete lines written to it as stream events."""
+
+    def __init__(self, name, channel, limit):
+        self.name = name
+        self.channel = channel
+        self.remaining = limit
+        self.dropped = 0
+        self.pending = ""
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        kept = data[:max(self.remaining, 0)]
+        self.remaining -= len(kept)
+        self.dropped += len(data) - len(kept)
+        self.pending += kept
+        if "\n" in self.pending:
+            lines, _, self.pending = self.pending.rpartition("\n")
+            self._emit(lines + "\n")
+        return len(data)
+
+    def flush(self):
+        if self.pending:
+            self._emit(self.pending)
+            self.pending = ""
+
+    def close_stream(self):
+        self.flush()
+        if self.dropped:
+            self._emit(f"\n[{self.dropped} characters of output dropped]\n")
+
+    def _emit(self, data):
+        self.channel.write(json.dumps({"stream": self.name, "data": data}) + "\n")
+        self.channel.flush()
+
+
+def run(code, stdout, stderr):
+    text, error = None, None
+    namespace = {"__name__": "__main__"}
+    try:
+        tree = ast.parse(code)
+        last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            exec(compile(tree, "<cell>", "exec"), namespace)
+            if last is not None:
+                value = eval(compile(ast.Expression(last.value), "<cell>", "eval"), namespace)
+                if value is not None:
+                    text = repr(value)
+    except BaseException as e:  # SystemExit and MemoryError included, the reply must go out
+        error = f"{type(e).__name__}: {e}"
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != "<cell>":
+            tb = tb.tb_next  # Hide the frames of this worker
+        stderr.write("".join(traceback.format_exception(type(e), e, tb)))
+    return {"text": text, "error": error}
+
+
+def main():
+    limit_resources(int(sys.argv[1]), int(sys.argv[2]))
+    channel = sys.stdout
+    request = json.loads(sys.stdin.readline())
+    stdout = _Stream("stdout", channel, request["max_output"])
+    stderr = _Stream("stderr", channel, request["max_output"])
+    sys.addaudithook(_audit)
+    reply = run(request["code"], stdout, stderr)
+    stdout.close_stream()
+    stderr.close_stream()
+    channel.write(json.dumps(reply) + "\n")
+    channel.flush()
+
+
+if __name__ == "__main__":
+    main()
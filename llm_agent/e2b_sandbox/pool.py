@@ -0,0 +1,241 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from e2b_code_interpreter import Sandbox
+
+from tracing.core import span
+
+
+class _Pooled:
+    """A sandbox plus the bookkeeping of the pool."""
+
+    def __init__(self, sandbox, expires: float):
+        self.sandbox = sandbox
+        self.expires = expires  # time.monotonic() at which E2B shuts the sandbox down
+        self.last_used = time.monotonic()
+        self.uses = 0
+        self.context = None  # Code context leases run in, None for the sandbox's default one
+        self.lock = threading.Lock()  # Held while leased, serializes calls of one session
+
+
+class SandboxPool:
+    """
+    Keeps sandboxes booted in the background and leases them to code executions,
+    so a call does not pay the sandbox startup latency.
+
+    Idle sandboxes are reused for up to `max_uses` executions and shut down after
+    `idle_ttl` seconds without use. Before a sandbox is reused, the background thread
+    gives it a fresh code context (a new kernel), so no imports or variables leak from
+    one lease to the next; files written by earlier leases stay until the sandbox is
+    replaced. Sandboxes that cannot create code contexts are not reused.
+    Sessions get a sandbox of their own whose kernel state (imports, variables)
+    survives between executions, until the session is idle for `idle_ttl`.
+    """
+
+    def __init__(self, size: int = 1, idle_ttl: float = 240.0, max_uses: int = 20,
+                 sandbox_timeout: int = 300, factory: Optional[Callable[[], Sandbox]] = None):
+        """
+        Args:
+            size: Number of idle sandboxes to keep ready.
+            idle_ttl: Seconds after which unused sandboxes and sessions are shut down.
+            max_uses: Executions after which a pooled sandbox is replaced by a fresh one.
+            sandbox_timeout: Lifetime in seconds E2B gives a sandbox, extended while it is in use.
+            factory: Creates a sandbox, `Sandbox(timeout=sandbox_timeout)` by default.
+                     Anything with `run_code` and `kill` methods works, e.g. a fake for tests;
+                     sandboxes are only reused if they also have `create_code_context`
+                     and `remove_code_context`.
+        """
+        self.size = size
+        self.idle_ttl = idle_ttl
+        self.max_uses = max_uses
+        self.sandbox_timeout = sandbox_timeout
+        self.factory = factory or (lambda: Sandbox(timeout=sandbox_timeout))
+        self._idle: List[_Pooled] = []
+        self._sessions: Dict[str, _Pooled] = {}
+        self._warming = 0
+        self._dirty: List[_Pooled] = []  # Released sandboxes waiting for a fresh code context
+        self._resetting = 0  # Sandboxes in `_dirty` or being reset
+        self._closed = False
+        self._changed = threading.Condition()
+
+        threading.Thread(target=self._maintain, daemon=True).start()
+
+    def _create(self) -> _Pooled:
+        return _Pooled(self.factory(), time.monotonic() + self.sandbox_timeout)
+
+    def _maintain(self):
+        """Resets released sandboxes, boots sandboxes until `size` are idle and shuts down expired ones."""
+        backoff = 1.0
+        while True:
+            with self._changed:
+                expired = self._take_expired()
+                dirty, self._dirty = self._dirty, []
+                missing = 0 if self._closed else self.size - len(self._idle) - self._warming - self._resetting
+                if not expired and not dirty and missing <= 0:
+                    if self._closed:
+                        return
+                    self._changed.wait(min(self.idle_ttl / 4, 5.0))
+                    continue
+                self._warming += max(missing, 0)
+
+            for pooled in expired:
+                self._kill(pooled)
+            for pooled in dirty:
+                reset = not self._closed and self._reset(pooled)
+                with self._changed:
+                    self._resetting -= 1
+                    if reset and not self._closed:
+                        self._idle.append(pooled)
+                    else:
+                        reset = False
+                    self._changed.notify_all()
+                if not reset:
+                    self._kill(pooled)
+            for _ in range(max(missing, 0)):
+                try:
+                    pooled = self._create()
+                except Exception as e:
+                    print(f"Error starting sandbox: {e} (retrying in {backoff:.0f} s)")
+                    with self._changed:
+                        self._warming -= 1
+                    time.sleep(backoff)  # Don't hammer the API while it is failing
+                    backoff = min(backoff * 2, 60.0)
+                    continue
+                backoff = 1.0
+                with self._changed:
+                    self._warming -= 1
+                    if self._closed:
+                        expired = [pooled]
+                    else:
+                        self._idle.append(pooled)
+                        self._changed.notify_all()
+                        expired = []
+                for pooled in expired:
+                    self._kill(pooled)
+
+    def _take_expired(self) -> List[_Pooled]:
+        """Removes the expired idle sandboxes and sessions. Call with `_changed` held."""
+        now = time.monotonic()
+
+        def expired(pooled):
+            return self._closed or now - pooled.last_used > self.idle_ttl or pooled.expires - now < 10.0
+
+        stale = [pooled for pooled in self._idle if expired(pooled)]
+        self._idle = [pooled for pooled in self._idle if not expired(pooled)]
+        for session_id, pooled in list(self._sessions.items()):
+            if expired(pooled) and not pooled.lock.locked():
+                stale.append(self._sessions.pop(session_id))
+        return stale
+
+    def _kill(self, pooled: _Pooled):
+        try:
+            pooled.sandbox.kill()
+        except Exception as e:
+            print(f"Error shutting down sandbox: {e}")
+
+    def _reset(self, pooled: _Pooled) -> bool:
+        """Gives a used sandbox a fresh code context, dropping the kernel state of earlier leases."""
+        if not hasattr(pooled.sandbox, "create_code_context"):
+            return False
+        try:
+            used, pooled.context = pooled.context, pooled.sandbox.create_code_context()
+            if used is not None:
+                pooled.sandbox.remove_code_context(used)
+        except Exception as e:
+            print(f"Error resetting sandbox: {e}")
+            return False
+        return True
+
+    def _refresh(self, pooled: _Pooled):
+        """Extends the sandbox lifetime once half of it is used up."""
+        if pooled.expires - time.monotonic() < self.sandbox_timeout / 2 and hasattr(pooled.sandbox, "set_timeout"):
+            pooled.sandbox.set_timeout(self.sandbox_timeout)
+            pooled.expires = time.monotonic() + self.sandbox_timeout
+
+    def _acquire(self, session: Optional[str]) -> _Pooled:
+        with self._changed:
+            if self._closed:
+                raise RuntimeError("Sandbox pool is closed")
+            if session is None or session not in self._sessions:
+                while not self._idle and self._resetting and not self._closed:
+                    self._changed.wait()  # A reset takes less than a cold start
+                if self._closed:
+                    raise RuntimeError("Sandbox pool is closed")
+            if session is not None and session in self._sessions:
+                pooled = self._sessions[session]
+            elif self._idle:
+                pooled = self._idle.pop()  # Most recently used first, the others can expire
+                self._changed.notify_all()  # Boot a replacement
+            else:
+                pooled = None
+            if pooled is not None:
+                pooled.last_used = time.monotonic()  # Keeps it from expiring until released
+        if pooled is None:
+            pooled = self._create()  # Cold start, the pool is exhausted
+        if session is not None:
+            with self._changed:
+                winner = self._sessions.setdefault(session, pooled)
+            if winner is not pooled:  # Another call started the session meanwhile
+                self._release(pooled, None, discard=False)
+            pooled = winner
+        return pooled
+
+    def _release(self, pooled: _Pooled, session: Optional[str], discard: bool):
+        pooled.last_used = time.monotonic()
+        pooled.uses += 1
+        with self._changed:
+            if session is not None:
+                if not discard and not self._closed:
+                    return
+                if self._sessions.get(session) is pooled:
+                    del self._sessions[session]
+            elif (not discard and not self._closed and pooled.uses < self.max_uses
+                  and len(self._idle) + self._resetting < self.size):
+                self._dirty.append(pooled)  # Reset by _maintain before it is leased again
+                self._resetting += 1
+                self._changed.notify_all()
+                return
+        self._kill(pooled)
+
+    @contextmanager
+    def lease(self, session: Optional[str] = None):
+        """
+        Leases a sandbox for the duration of the `with` block. Sandboxes that raised
+        are shut down instead of being reused.
+
+        Args:
+            session: Name of a persistent session; all leases of a session share one sandbox
+                     and kernel state and run one after another. Without a session, every
+                     lease starts with fresh kernel state.
+
+        Yields:
+            (Sandbox, Context or None): The sandbox and the code context to pass to `run_code`.
+        """
+        with span("sandbox.acquire"):  # Long ones are cold starts
+            pooled = self._acquire(session)
+        with pooled.lock:
+            discard = True
+            try:
+                self._refresh(pooled)
+                yield pooled.sandbox, pooled.context
+                discard = False
+            finally:
+                self._release(pooled, session, discard)
+
+    def close_session(self, session: str):
+        """Shuts down the sandbox of a session, dropping its kernel state."""
+        with self._changed:
+            pooled = self._sessions.pop(session, None)
+        if pooled is not None:
+            self._kill(pooled)
+
+    def close(self):
+        """Shuts down all idle sandboxes and sessions. Leased sandboxes are shut down on release."""
+        with self._changed:
+            self._closed = True
+            stale = self._take_expired()
+            self._changed.notify_all()
+        for pooled in stale:
+            self._kill(pooled)
@@ -0,0 +1,76 @@
+"""
+Wire protocol between RobotController and the EV3 server (server.py).
+
+Every message is a single UTF-8 line terminated by a newline:
+
+    request:  "<id> <command>\n"               e.g. "7 forward 2.0"
+    reply:    "<id> <status> <detail>\n"       e.g. "7 ok forward 2.0" or "7 err Unknown command: fly"
+
+Request ids are positive integers chosen by the client. The server answers every request
+exactly once, when the action has finished, so many requests can be in flight at once and
+replies may arrive in any order.
+
+Request id 0 is reserved for events the server pushes on its own, e.g. the samples of a
+`telemetry <hz>` subscription:
+
+    event:    "0 telemetry <json>\n"
+
+server.py keeps its own copy of this format because it is deployed to the brick on its own.
+"""
+
+STATUS_OK = "ok"
+STATUS_ERROR = "err"
+
+EVENT_ID = 0  # Request id of unsolicited server events
+EVENT_TELEMETRY = "telemetry"
+
+
+class ProtocolError(Exception):
+    """Raised for malformed protocol lines."""
+
+
+def encode_request(request_id: int, command: str) -> bytes:
+    if "\n" in command:
+        raise ProtocolError("Commands must not contain newlines")
+    return f"{request_id} {command}\n".encode()
+
+
+def encode_reply(request_id: int, status: str, detail: str = "") -> bytes:
+    return f"{request_id} {status} {detail.replace(chr(10), ' ')}\n".encode()
+
+
+def parse_request(line: str):
+    """
+    Returns:
+        tuple: (request id, command)
+    """
+    request_id, _, command = line.strip().partition(" ")
+    if not request_id.isdigit() or not command:
+        raise ProtocolError(f"Malformed request: {line!r}")
+    return int(request_id), command
+
+
+def parse_reply(line: str):
+    """
+    Returns:
+        tuple: (request id, status, detail)
+    """
+    parts = line.rstrip("\n").split(" ", 2)
+    if len(parts) < 2 or not parts[0].isdigit():
+        raise ProtocolError(f"Malformed reply: {line!r}")
+    return int(parts[0]), parts[1], parts[2] if len(parts) > 2 else ""
+
+
+class LineReader:
+    """Splits a byte stream into complete lines, keeping partial lines for the next read."""
+
+    def __init__(self):
+        self._buffer = b""
+
+    def feed(self, data: bytes):
+        """Adds received bytes and returns the list of complete lines (decoded, without newline)."""
+        self._buffer += data
+        if b"\n" not in self._buffer:
+            return []
+        *lines, self._buffer = self._buffer.split(b"\n")
+        return [line.decode() for line in lines]
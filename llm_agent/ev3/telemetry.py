@@ -0,0 +1,97 @@
+"""
+Telemetry pushed by the EV3 server (see the `telemetry` command in server.py) and
+dead-reckoning odometry computed from it.
+"""
+
+import json
+import math
+from collections import namedtuple
+
+# Ports of the drive motors (MoveTank in server.py) and the medium motor
+DRIVE_PORTS = ("B", "C")
+MEDIUM_PORT = "D"
+
+Pose = namedtuple("Pose", ["x", "y", "heading", "distance"])  # mm, mm, degrees, mm driven in total
+
+
+class Telemetry(namedtuple("Telemetry", ["seq", "received", "positions", "speeds", "running", "battery_volts"])):
+    """
+    One telemetry sample of the brick.
+
+    `positions` (tacho counts in degrees), `speeds` (degrees per second) and `running`
+    are dicts keyed by output port ("B", "C", "D"). `received` is the time.monotonic()
+    at which the host received the sample.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, payload: str, received: float) -> "Telemetry":
+        data = json.loads(payload)
+        motors = data["motors"]
+        return cls(
+            seq=int(data["seq"]),
+            received=received,
+            positions={port: int(motor["position"]) for port, motor in motors.items()},
+            speeds={port: int(motor["speed"]) for port, motor in motors.items()},
+            running={port: "running" in motor["state"] for port, motor in motors.items()},
+            battery_volts=data.get("battery_volts"),
+        )
+
+    @property
+    def driving(self) -> bool:
+        """True while any drive motor is running."""
+        return any(self.running.get(port, False) for port in DRIVE_PORTS)
+
+    @property
+    def idle(self) -> bool:
+        """True when no motor is running."""
+        return not any(self.running.values())
+
+
+class Odometry:
+    """
+    Integrates the drive motor tacho counts into a 2D pose relative to where tracking started.
+
+    Wheel slip is not accounted for, so the pose drifts over time; it is meant as a rough
+    hint for the model, not for navigation.
+    """
+
+    def __init__(self, wheel_diameter: float = 56.0, axle_track: float = 120.0):
+        """
+        Args:
+            wheel_diameter: Wheel diameter in mm (56 mm for the standard EV3 tire).
+            axle_track: Distance between the wheels in mm.
+        """
+        self.mm_per_degree = math.pi * wheel_diameter / 360
+        self.axle_track = axle_track
+        self.pose = Pose(0.0, 0.0, 0.0, 0.0)
+        self._last_positions = None
+
+    def rebase(self):
+        """Forgets the last tacho counts, e.g. after a reconnect (the brick may have restarted)."""
+        self._last_positions = None
+
+    def update(self, telemetry: Telemetry) -> Pose:
+        positions = tuple(telemetry.positions.get(port) for port in DRIVE_PORTS)
+        if None in positions:
+            return self.pose
+        last, self._last_positions = self._last_positions, positions
+        if last is None:
+            return self.pose
+
+        # Negative wheel speeds drive forward and "left" runs B forward and C backward,
+        # matching drive_speeds in server.py
+        b = -(positions[0] - last[0]) * self.mm_per_degree
+        c = -(positions[1] - last[1]) * self.mm_per_degree
+        forward = (b + c) / 2
+        turn = (b - c) / self.axle_track  # Radians, counterclockwise
+
+        x, y, heading, distance = self.pose
+        mid_heading = math.radians(heading) + turn / 2
+        self.pose = Pose(
+            x=x + forward * math.cos(mid_heading),
+            y=y + forward * math.sin(mid_heading),
+            heading=(heading + math.degrees(turn) + 180) % 360 - 180,
+            distance=distance + abs(forward),
+        )
+        return self.pose
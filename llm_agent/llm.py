@@ -1,106 +1,250 @@
-from openai import OpenAI
+from openai import AsyncOpenAI
+import asyncio
 import os
 from dotenv import load_dotenv
 from typing import Dict, List, Tuple
 
+from .e2b_sandbox.backends import ExecutionBackend
 from .e2b_sandbox.execute import ExecutePythonFunction, GenerateRandomNumberFunction
 from .ev3.robot import *
+from .messages import Message, parse_arguments, to_wire
+from tracing.core import record, span
 import json
+import time
+import weakref
 
 load_dotenv()
 EV3_IP_ADDRESS = os.environ.get("EV3_IP_ADDRESS")
-robot = RobotController(ip=EV3_IP_ADDRESS)
 
 
 class OpenAIModel:
     """
     Communicates with the OpenAI Api
     """
-    def __init__(self):
+    # Tools that depend on each other: a new motion preempts the current one on the robot,
+    # so these run one after another in call order while other tools run concurrently
+    SEQUENTIAL_TOOLS = {"move", "move_sequence"}
+
+    def __init__(self, max_tool_rounds: int = 5, stream: bool = False, robot: RobotController = None,
+                 base_url: str = None, api_key: str = None, execution_backend: ExecutionBackend = None):
+        """
+        Args:
+            max_tool_rounds: Rounds of tool calls allowed per completion.
+            stream: Stream responses and start tools before the response is complete.
+            robot: Controller of the robot, one for EV3_IP_ADDRESS by default.
+            base_url: OpenAI-compatible endpoint, e.g. a local mock for replays. Defaults to OpenAI.
+            api_key: API key, OPEN_AI_KEY from the environment by default.
+            execution_backend: Backend of the execute_python tool, see ExecutePythonFunction.
+        """
         self.model = "gpt-4o-mini"
         self.default_image_quality = "low"
+        self.max_tool_rounds = max_tool_rounds  # Rounds of tool calls allowed per completion
+        self.stream = stream  # Stream responses and start tools before the response is complete
 
         load_dotenv()
-        openai_api_key = os.environ.get("OPEN_AI_KEY")
-        self.client = OpenAI(api_key=openai_api_key)
+        openai_api_key = api_key or os.environ.get("OPEN_AI_KEY")
+        self.client = AsyncOpenAI(api_key=openai_api_key, base_url=base_url)
+        self._loop = asyncio.new_event_loop()
+        # Event loop -> asyncio.Lock of SEQUENTIAL_TOOLS; a lock only works on the loop it was first used on
+        self._sequential_locks = weakref.WeakKeyDictionary()
+
+        # The controller connects lazily, so creating it does not block on the robot
+        self.robot = robot if robot is not None else RobotController(ip=EV3_IP_ADDRESS)
 
         # Register available functions
         self.available_tools = {
-            "execute_python": ExecutePythonFunction(robot),
-            "move": MoveFunction(robot),
-            "speak": SpeakFunction(robot)
+            "execute_python": ExecutePythonFunction(self.robot, backend=execution_backend),
+            "move": MoveFunction(self.robot),
+            "move_sequence": MoveSequenceFunction(self.robot),
+            "speak": SpeakFunction(self.robot)
         }
 
     def complete(self, messages: list):
+        """
+        Synchronous wrapper around `acomplete` for callers without an event loop.
+
+        Runs on a persistent event loop so the async HTTP client can reuse its connections.
+        """
+        return self._loop.run_until_complete(self.acomplete(messages))
+
+    def close(self):
+        """Closes the HTTP client and the event loop of `complete`, finalizing what streams left behind."""
+        self._loop.run_until_complete(self.client.close())
+        self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+        self._loop.close()
+
+    async def acomplete(self, messages: list):
         """
         Sends a conversation to the OpenAI API and processes responses,
         including tool calls when required.
+
+        `messages` may mix Message objects and plain dicts; images held by
+        Messages are only encoded into the request payload here.
+
+        Tool calls of one assistant turn run concurrently. After `max_tool_rounds`
+        rounds of tool calls the model is asked to answer without tools.
+        """
+        for tool_round in range(self.max_tool_rounds + 1):
+            tool_choice = "auto" if tool_round < self.max_tool_rounds else "none"
+            with span("llm.request", round=tool_round, stream=self.stream) as request_span:
+                if self.stream:
+                    content, tool_calls, running_tools = await self._stream_completion(messages, tool_choice)
+                else:
+                    content, tool_calls = await self._create_completion(messages, tool_choice)
+                    running_tools = None
+                request_span.set(tool_calls=len(tool_calls))
+
+            # Append the assistant's response to maintain conversation history
+            messages.append(Message("assistant", content, tool_calls=tool_calls))
+
+            if not tool_calls:
+                break
+
+            # Process the tool calls requested by the model and continue the conversation
+            with span("llm.wait_for_tools", round=tool_round):
+                if running_tools is not None:
+                    messages.extend(await asyncio.gather(*running_tools))
+                else:
+                    messages.extend(await self._handle_tool_calls(tool_calls))
+
+        return content, messages
+
+    async def _create_completion(self, messages, tool_choice):
         """
-        response = self.client.chat.completions.create(
+        Requests a whole completion at once.
+
+        Returns:
+            tuple: (content, list of (id, name, arguments) tool calls)
+        """
+        with span("llm.encode_request"):
+            wire_messages = to_wire(messages)
+        response = await self.client.chat.completions.create(
             model=self.model,
-            messages=messages,
+            messages=wire_messages,
             tools=[tool.function_schema for tool in self.available_tools.values()],
-            tool_choice="auto"
+            tool_choice=tool_choice
         )
 
         response_message = response.choices[0].message
+        tool_calls = [(tool_call.id, tool_call.function.name, tool_call.function.arguments)
+                      for tool_call in response_message.tool_calls or []]
+        return response_message.content, tool_calls
 
-        # print("Initial response: ")
-        # print(response_message)
-        # print("\n")
-
-        # Append the assistant's response to maintain conversation history
-        messages.append({
-            "role": "assistant",
-            "content": response_message.content,
-            "tool_calls": response_message.tool_calls
-        })
-
-        # Process any tool calls requested by the model
-        if response_message.tool_calls:
-            tool_responses = self._handle_tool_calls(response_message.tool_calls)
-
-            # Append tool responses to messages
-            messages.extend(tool_responses)
-
-            # Re-run the conversation with updated messages
-            return self.complete(messages)
+    async def _stream_completion(self, messages, tool_choice):
+        """
+        Streams a completion and dispatches every tool call as soon as its arguments are
+        complete, while the rest of the response is still arriving.
 
-        return response_message.content, messages
+        Returns:
+            tuple: (content, list of (id, name, arguments) tool calls, list of tool tasks
+                   in the same order, each resolving to the tool response Message)
+        """
+        with span("llm.encode_request"):
+            wire_messages = to_wire(messages)
+        start = time.perf_counter()
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=wire_messages,
+            tools=[tool.function_schema for tool in self.available_tools.values()],
+            tool_choice=tool_choice,
+            stream=True
+        )
 
-    def _handle_tool_calls(self, tool_calls):
+        content = []
+        calls = {}  # Tool call index -> [id, name, arguments]
+        tasks = {}  # Tool call index -> running tool task
+
+        first_chunk = True
+        try:
+            async for chunk in stream:
+                if first_chunk:
+                    record("llm.first_chunk", time.perf_counter() - start)  # Time to first token
+                    first_chunk = False
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content.append(delta.content)
+
+                for tool_call_delta in delta.tool_calls or []:
+                    call = calls.setdefault(tool_call_delta.index, ["", "", ""])
+                    if tool_call_delta.id:
+                        call[0] = tool_call_delta.id
+                    if tool_call_delta.function is not None:
+                        call[1] += tool_call_delta.function.name or ""
+                        fragment = tool_call_delta.function.arguments or ""
+                        call[2] += fragment
+
+                        # Arguments are a single JSON object, so they can only be complete once it closes
+                        if tool_call_delta.index not in tasks and "}" in fragment and _is_complete_json(call[2]):
+                            tasks[tool_call_delta.index] = asyncio.create_task(self._run_tool(*call))
+        except BaseException:
+            # Tools already dispatched must not outlive the failed turn unawaited; those still
+            # waiting (e.g. for an earlier motion) are not started. Cancelling does not reach a
+            # tool already running in its thread, so a motion in progress is stopped on the robot.
+            for task in tasks.values():
+                task.cancel()
+            if any(calls[index][1] in self.SEQUENTIAL_TOOLS for index in tasks):
+                self.robot.submit("stop")
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            await stream.close()
+            raise
+
+        # Calls whose arguments never parsed still need a response
+        for index, call in calls.items():
+            if index not in tasks:
+                tasks[index] = asyncio.create_task(self._run_tool(*call))
+
+        order = sorted(calls)
+        return "".join(content) or None, [tuple(calls[i]) for i in order], [tasks[i] for i in order]
+
+    async def _handle_tool_calls(self, tool_calls):
         """
         Handles execution of tool calls requested by the model.
 
+        Independent calls run concurrently, so the turn takes about as long as the slowest
+        tool instead of the sum of all of them. Motions (SEQUENTIAL_TOOLS) run in call order.
+
         Args:
-            tool_calls (list): List of tool calls requested by the model.
+            tool_calls (list): List of (id, name, arguments) tool calls requested by the model.
 
         Returns:
-            list: List of responses from the executed tools.
+            list: List of tool response Messages, in the order of `tool_calls`.
         """
-        tool_call_responses = []
-
-        for tool_call in tool_calls:
-            tool_name = tool_call.function.name
-            arguments = json.loads(tool_call.function.arguments)
-
-            if tool_name in self.available_tools:
-                tool_response = self.available_tools[tool_name].execute(**arguments)
-
-                tool_call_responses.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "name": tool_name,
-                    "content": tool_response
-                })
-
-                # Extract sleep duration
-                if tool_name == "move" and "duration" in arguments:
-                    time.sleep(arguments["duration"])
-                elif tool_name == "speak" and "text" in arguments:
-                    words = len(arguments["text"].split())
-                    sleep_time = words
-                    time.sleep(sleep_time)
-
-        return tool_call_responses
-
+        return await asyncio.gather(*(self._run_tool(*tool_call) for tool_call in tool_calls))
+
+    async def _run_tool(self, tool_call_id, tool_name, arguments):
+        arguments = parse_arguments(arguments)
+
+        if tool_name in self.SEQUENTIAL_TOOLS:
+            loop = asyncio.get_running_loop()
+            lock = self._sequential_locks.get(loop)
+            if lock is None:
+                lock = self._sequential_locks[loop] = asyncio.Lock()
+            # Tasks reach the lock in the order they were created and it is handed over first come, first served
+            async with lock:
+                tool_response = await self._execute_tool(tool_name, arguments)
+        else:
+            tool_response = await self._execute_tool(tool_name, arguments)
+
+        # Every tool call needs a response, otherwise the next request is rejected
+        return Message("tool", tool_response, tool_call_id=tool_call_id, name=tool_name)
+
+    async def _execute_tool(self, tool_name, arguments):
+        if tool_name not in self.available_tools:
+            return f"Unknown tool: {tool_name}"
+        try:
+            # Tools are blocking (sockets, sandboxes), run them off the event loop.
+            # Robot tools return once the robot reports the action as finished.
+            with span(f"tool.{tool_name}"):
+                return await asyncio.to_thread(self.available_tools[tool_name].execute, **arguments)
+        except Exception as e:
+            return f"Error executing {tool_name}: {e}"
+
+
+def _is_complete_json(text: str) -> bool:
+    try:
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,141 @@
+import os
+
+from .messages import Message, parse_arguments
+
+# Rough token costs used for budgeting. Images sent with detail "low" cost a flat 85 tokens.
+CHARS_PER_TOKEN = 4
+LOW_DETAIL_IMAGE_TOKENS = 85
+HIGH_DETAIL_IMAGE_TOKENS = 765  # 2x2 tiles of a 512x512 image at "high" detail
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(message: Message) -> int:
+    """Estimates how many prompt tokens a chat message costs."""
+    tokens = MESSAGE_OVERHEAD_TOKENS + len(message.text) // CHARS_PER_TOKEN
+    for image in message.images:
+        tokens += LOW_DETAIL_IMAGE_TOKENS if image.detail == "low" else HIGH_DETAIL_IMAGE_TOKENS
+    for _, name, arguments in message.tool_calls or ():
+        tokens += MESSAGE_OVERHEAD_TOKENS + (len(name or "") + len(arguments or "")) // CHARS_PER_TOKEN
+    return tokens
+
+
+class MemoryManager:
+    def __init__(self, max_steps=5, token_budget=4000, keep_images=1, image_dir=None):
+        """
+        Args:
+            max_steps (int): Maximum number of iterations kept in memory.
+            token_budget (int): Estimated prompt tokens the stored memory may use. The oldest
+                                iterations are dropped once it is exceeded (the newest one is
+                                always kept).
+            keep_images (int): Number of newest iterations whose images are kept as pixels.
+                               Images of older iterations are replaced by a short text stub
+                               carrying what the model said about them.
+            image_dir (str, optional): If set, stored images are spilled to this directory and
+                                       only read back when a request is sent.
+        """
+        # Stores past iterations, each iteration is a list of Messages
+        self.iterations = []
+        self.last_message_count = 0  # Tracks number of messages before last LLM call
+        self.system_prompt = Message(
+            "system", "You are a helpful robot assistant. Follow user instructions carefully.")
+        self.max_steps = max_steps
+        self.token_budget = token_budget
+        self.keep_images = keep_images
+        self.image_dir = image_dir
+        self.iteration_number = 0  # Tracks the iteration count
+
+        if self.image_dir is not None:
+            os.makedirs(self.image_dir, exist_ok=True)
+
+    def add_iteration(self, new_messages):
+        """Extracts and stores only new messages as a new iteration (for LLM responses)."""
+        new_iteration = [Message.from_wire(m) for m in new_messages[self.last_message_count:]]
+        if new_iteration:
+            self._spill_images(new_iteration)
+            self.iterations.append(new_iteration)
+        self.last_message_count = len(new_messages)
+        self._demote_images()
+        self._trim_memory(self.max_steps)
+        self._trim_to_budget()
+        self.iteration_number += 1  # Increment after storing LLM response
+
+    def get_memory_as_messages(self):
+        """
+        Returns stored memory as a flat list of Messages, ensuring system prompt is included.
+
+        Images stay as references; `OpenAIModel.complete` materializes them at send time.
+        """
+        messages = [self.system_prompt] + [msg for iteration in self.iterations for msg in iteration]
+        self.last_message_count = len(messages)  # New messages start after the stored memory
+        return messages
+
+    def estimate_tokens(self) -> int:
+        """Estimated prompt tokens of the stored memory, including the system prompt."""
+        return estimate_tokens(self.system_prompt) + sum(
+            estimate_tokens(msg) for iteration in self.iterations for msg in iteration)
+
+    def _trim_memory(self, steps):
+        """Keeps only the last `steps` iterations while preserving the system prompt."""
+        if len(self.iterations) > steps:
+            for iteration in self.iterations[:-steps]:
+                self._delete_spilled(iteration)
+            self.iterations = self.iterations[-steps:]
+
+    def _trim_to_budget(self):
+        """Drops the oldest iterations until the memory fits into the token budget."""
+        while len(self.iterations) > 1 and self.estimate_tokens() > self.token_budget:
+            self._delete_spilled(self.iterations.pop(0))
+
+    def _spill_images(self, iteration):
+        if self.image_dir is None:
+            return
+        for index, message in enumerate(iteration):
+            for image_index, image in enumerate(message.images):
+                path = os.path.join(self.image_dir, f"memory_{self.iteration_number}_{index}_{image_index}.jpg")
+                image.spill(path)
+
+    def _demote_images(self):
+        """Replaces images of all but the newest `keep_images` iterations with text stubs."""
+        with_images = [i for i, iteration in enumerate(self.iterations) if any(m.images for m in iteration)]
+        for index in with_images[:max(0, len(with_images) - self.keep_images)]:
+            iteration = self.iterations[index]
+            caption = self._caption(iteration)
+            stub = "[Earlier camera image omitted"
+            stub += f". The robot's notes on it: {caption}]" if caption else "]"
+            self._delete_spilled(iteration)
+            self.iterations[index] = [m.replace_images(stub) if m.images else m for m in iteration]
+
+    @staticmethod
+    def _delete_spilled(iteration):
+        """Removes the files of the spilled images of an iteration that is dropped or demoted."""
+        for message in iteration:
+            for image in message.images:
+                if image.path is not None and image.data is None:
+                    os.remove(image.path)
+
+    @staticmethod
+    def _caption(iteration) -> str:
+        """Collects what the model said or did in an iteration, to stand in for its image."""
+        notes = []
+        for message in iteration:
+            if message.role != "assistant":
+                continue
+            if message.text.strip():
+                notes.append(message.text.strip())
+            for _, name, arguments in message.tool_calls or ():
+                arguments = parse_arguments(arguments)
+                if name == "speak" and "message" in arguments:
+                    notes.append(f'said "{arguments["message"]}"')
+                elif name == "move" and "command" in arguments:
+                    notes.append(f'moved {arguments["command"]} for {arguments.get("duration")} s')
+                elif name == "move_sequence" and arguments.get("segments"):
+                    notes.append("moved " + ", ".join(segment.get("direction", "?") for segment in arguments["segments"]))
+        return "; ".join(notes)
+
+    def print_memory(self):
+        """Prints stored memory with formatting and images replaced by short placeholders."""
+        print("\n\n\n")
+        for i, iteration in enumerate(self.iterations):
+            print(f"Iteration {i + 1} Messages:")
+            for m in iteration:
+                print(m.redacted())
@@ -0,0 +1,176 @@
+import base64
+import json
+import os
+
+from tracing.core import span
+
+
+class ImageRef:
+    """
+    An image held once, as encoded bytes or as a path to an encoded file on disk.
+
+    It is only turned into a base64 data URL when a request is actually sent.
+    """
+    __slots__ = ("data", "path", "mime_type", "detail")
+
+    def __init__(self, data: bytes = None, path: str = None, mime_type: str = "image/jpeg", detail: str = "low"):
+        if data is None and path is None:
+            raise ValueError("ImageRef needs either data or a path")
+        self.data = data
+        self.path = path
+        self.mime_type = mime_type
+        self.detail = detail
+
+    @classmethod
+    def from_url(cls, url: str, detail: str = "low"):
+        """Parses a base64 data URL back into bytes. Other URLs are not supported."""
+        header, _, payload = url.partition(",")
+        if not header.startswith("data:") or not header.endswith(";base64"):
+            raise ValueError("Only base64 data URLs can be stored as ImageRef")
+        return cls(data=base64.b64decode(payload), mime_type=header[5:-7], detail=detail)
+
+    @property
+    def size(self) -> int:
+        """Encoded size in bytes, without reading a spilled file."""
+        if self.data is not None:
+            return len(self.data)
+        return os.path.getsize(self.path)
+
+    def read(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def spill(self, path: str):
+        """Writes the bytes to `path` and drops them from memory."""
+        if self.data is None:
+            return
+        with open(path, "wb") as f:
+            f.write(self.data)
+        self.path = path
+        self.data = None
+
+    def to_wire(self) -> dict:
+        with span("image.base64"):
+            url = f"data:{self.mime_type};base64," + base64.b64encode(self.read()).decode("ascii")
+        return {"type": "image_url", "image_url": {"url": url, "detail": self.detail}}
+
+    def redacted(self) -> dict:
+        where = self.path if self.data is None else f"{len(self.data)} bytes"
+        return {"type": "image_url", "image_url": {"url": f"<{self.mime_type} {where}>", "detail": self.detail}}
+
+
+class Message:
+    """
+    A compact chat message.
+
+    `content` is either a string or a tuple of parts, each part being a text string or an
+    ImageRef. Tool calls are stored as (id, name, arguments) tuples instead of API objects.
+    Use `to_wire` to get the dict the OpenAI API expects.
+    """
+    __slots__ = ("role", "content", "tool_calls", "tool_call_id", "name")
+
+    def __init__(self, role: str, content=None, tool_calls=None, tool_call_id: str = None, name: str = None):
+        self.role = role
+        self.content = tuple(content) if isinstance(content, list) else content
+        self.tool_calls = tuple(tool_calls) if tool_calls else None
+        self.tool_call_id = tool_call_id
+        self.name = name
+
+    @classmethod
+    def user(cls, *parts):
+        """Builds a user message from text strings and ImageRefs."""
+        return cls("user", parts)
+
+    @classmethod
+    def from_wire(cls, message):
+        """Converts an OpenAI-style message dict into a Message (Messages pass through)."""
+        if isinstance(message, Message):
+            return message
+
+        content = message.get("content")
+        if isinstance(content, list):
+            parts = []
+            for item in content:
+                if item.get("type") == "image_url":
+                    parts.append(ImageRef.from_url(item["image_url"]["url"], item["image_url"].get("detail", "low")))
+                else:
+                    parts.append(item.get("text", ""))
+            content = parts
+
+        tool_calls = None
+        if message.get("tool_calls"):
+            tool_calls = [_tool_call_tuple(tool_call) for tool_call in message["tool_calls"]]
+
+        return cls(message["role"], content, tool_calls, message.get("tool_call_id"), message.get("name"))
+
+    @property
+    def images(self):
+        if not isinstance(self.content, tuple):
+            return []
+        return [part for part in self.content if isinstance(part, ImageRef)]
+
+    @property
+    def text(self) -> str:
+        """All text of the message joined together."""
+        if isinstance(self.content, tuple):
+            return " ".join(part for part in self.content if isinstance(part, str))
+        return self.content or ""
+
+    def replace_images(self, stub: str):
+        """Returns a copy of the message with every image replaced by the text `stub`."""
+        content = tuple(stub if isinstance(part, ImageRef) else part for part in self.content)
+        return Message(self.role, content, self.tool_calls, self.tool_call_id, self.name)
+
+    def to_wire(self) -> dict:
+        return self._render(lambda image: image.to_wire())
+
+    def redacted(self) -> dict:
+        """Like `to_wire`, but images are shown as short placeholders. Meant for logs."""
+        return self._render(lambda image: image.redacted())
+
+    def _render(self, render_image) -> dict:
+        if isinstance(self.content, tuple):
+            content = [render_image(part) if isinstance(part, ImageRef) else {"type": "text", "text": part}
+                       for part in self.content]
+        else:
+            content = self.content
+
+        message = {"role": self.role, "content": content}
+        if self.tool_calls:
+            message["tool_calls"] = [
+                {"id": call_id, "type": "function", "function": {"name": name, "arguments": arguments}}
+                for call_id, name, arguments in self.tool_calls
+            ]
+        if self.tool_call_id is not None:
+            message["tool_call_id"] = self.tool_call_id
+        if self.name is not None:
+            message["name"] = self.name
+        return message
+
+    def __repr__(self):
+        return f"Message({self.redacted()!r})"
+
+
+def _tool_call_tuple(tool_call):
+    """Returns (id, name, arguments) of a tool call given as an OpenAI object or a dict."""
+    if isinstance(tool_call, tuple):
+        return tool_call
+    if isinstance(tool_call, dict):
+        function = tool_call.get("function", {})
+        return tool_call.get("id"), function.get("name"), function.get("arguments", "")
+    return tool_call.id, tool_call.function.name, tool_call.function.arguments
+
+
+def to_wire(messages) -> list:
+    """Materializes a list of Messages and/or message dicts into the OpenAI wire format."""
+    return [message.to_wire() if isinstance(message, Message) else message for message in messages]
+
+
+def parse_arguments(arguments: str) -> dict:
+    """Parses tool call arguments, returning an empty dict for malformed JSON."""
+    try:
+        return json.loads(arguments)
+    except (TypeError, ValueError):
+        return {}
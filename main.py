@@ -1,126 +1,365 @@
 from droidcam.core import *
+from droidcam.scene import SceneChangeDetector
 from llm_agent.llm import *
+from llm_agent.memory import MemoryManager
+from llm_agent.messages import ImageRef, Message
+from tracing.core import enable as enable_tracing, iteration, span
 
+import os
+import signal
+import threading
 import time
+from collections import namedtuple
 
+DROIDCAM_IP = os.environ.get("DROIDCAM_IP")
+MAX_SKIPPED_STEPS = 3  # Ask the model again after this many unchanged frames in a row
+STEP_DELAY = 5.0  # Seconds between steps
+MIN_STEP_INTERVAL = 1.0  # Seconds between the starts of pipelined steps, paces steps that reuse a response
+# Seconds an unchanged scene reuses the last response in the pipelined loop before the model is asked again,
+# about as long as MAX_SKIPPED_STEPS steps of the sequential loop
+MAX_RESPONSE_REUSE = 20.0
+TASK_PROMPT = ("Look for a written problem to solve. If you find it, solve it using execute_python tool."
+               "If you don't see a problem to solve, explore the area using the move tool and make a very short comment on what you see"
+               "using the speak tool ")
 
-llm = OpenAIModel()
-droidcam = DroidCamHandler(ip_address=DROIDCAM_IP,
-                           log_level=LogLevel.SNAPSHOT)
-time.sleep(1)
-
-
-class MemoryManager:
-    def __init__(self, max_steps=5):
-        # Stores past iterations, each iteration is a list of messages
-        self.iterations = []
-        self.last_message_count = 0  # Tracks number of messages before last LLM call
-        self.system_prompt = {
-            "role": "system",
-            "content": "You are a helpful robot assistant. Follow user instructions carefully."
-        }
-        self.max_steps = max_steps
-        self.iteration_number = 0  # Tracks the iteration count
-
-    def add_iteration(self, new_messages):
-        """Extracts and stores only new messages as a new iteration (for LLM responses)."""
-        new_iteration = new_messages[self.last_message_count:]
-        if new_iteration:
-            self.iterations.append(new_iteration)
-        self.last_message_count = len(new_messages)
-        self._trim_memory(self.max_steps)
-        self.iteration_number += 1  # Increment after storing LLM response
-
-    def get_memory_as_messages(self):
-        """Returns stored memory as a flat list of messages, ensuring system prompt is included."""
-        return [self.system_prompt] + [msg for iteration in self.iterations for msg in iteration]
-
-    def _trim_memory(self, steps):
-        """Keeps only the last `steps` iterations while preserving the system prompt."""
-        if len(self.iterations) > steps:
-            self.iterations = self.iterations[-steps:]
-
-    def print_memory(self):
-        """Prints stored memory with formatting and base64 filtering."""
-        print("\n\n\n")
-        for i, iteration in enumerate(self.iterations):
-            print(f"Iteration {i + 1} Messages:")
-            for m in iteration:
-                content_to_print = m.get('content', '')
-                if isinstance(content_to_print, list):
-                    filtered_content = []
-                    for item in content_to_print:
-                        if item.get('type') == 'image_url' and 'image_url' in item:
-                            url = item['image_url']['url']
-                            if 'base64' in url:
-                                base64_start = url.find('base64,')
-                                if base64_start != -1:
-                                    item = {
-                                        'type': 'image_url',
-                                        'image_url': {
-                                            'url': url[:base64_start + 7] + ' <BASE64_DATA_HIDDEN>',
-                                            'detail': item['image_url'].get('detail', 'low')
-                                        }
-                                    }
-                        filtered_content.append(item)
-                    content_to_print = filtered_content
-
-                message_to_print = m.copy()
-                message_to_print['content'] = content_to_print
-                print(message_to_print)
-
-
-def get_front_camera_image_message(droidcam_object):
-    """Captures an image from the front camera and returns it as a message."""
-    image = droidcam_object.take_snapshot()
-    base64_image = encode_image_pil(image)
-
-    return {
-        "role": "user",
-        "content": [
-            {
-                "type": "text",
-                "text": f"View from robot front camera.",
-            },
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{base64_image}",
-                    "detail": "low",
-                },
-            },
-        ],
-    }
-
-
-memory = MemoryManager()
-
-# Run multiple iterations
-for i in range(5):
-    new_iteration_messages = [
-        get_front_camera_image_message(droidcam_object=droidcam),
-        {
-            "role": "user",
-            "content": [
-                {
-                    "type": "text",
-                    "text": "Look for a written problem to solve. If you find it, solve it using execute_python tool."
-                            "If you don't see a problem to solve, explore the area using the move tool and make a very short comment on what you see"
-                            "using the speak tool ",
-                },
-            ],
-        },
-    ]
-
-    # Step 2: Pass stored memory + new iteration messages to LLM
-    response, messages = llm.complete(messages=memory.get_memory_as_messages() + new_iteration_messages)
-
-    # Step 3: Store the full step in memory
-    memory.add_iteration(messages)
-
-    memory.print_memory()
-
-    print(f"\n\nModel response: {response}")
-
-    print("Sleeping...")
-    time.sleep(5)
+
+def camera_image_message(jpeg):
+    """The message showing the model an encoded camera image."""
+    return Message.user("View from robot front camera.", ImageRef(data=jpeg, detail="low"))
+
+
+def get_front_camera_image_message(droidcam_object, frame=None):
+    """
+    Captures an image from the front camera (or encodes `frame`) and returns it as a message,
+    None if there is no frame or it could not be encoded.
+    """
+    jpeg = droidcam_object.encode_snapshot(snapshot=frame)
+    if jpeg is None:
+        return None
+
+    return camera_image_message(jpeg)
+
+
+def build_step_messages(droidcam, frame, robot, image_message=None):
+    """
+    The user messages of one step: camera view (`image_message` if already encoded), robot state
+    and the task. None if there is no camera view.
+    """
+    image_message = image_message or get_front_camera_image_message(droidcam_object=droidcam, frame=frame)
+    if image_message is None:
+        return None
+    messages = [image_message]
+    robot_state = robot.describe_state()
+    if robot_state is not None:
+        messages.append(Message.user(robot_state))
+    messages.append(Message.user(TASK_PROMPT))
+    return messages
+
+
+def run(llm, droidcam, iterations=5, step_delay=STEP_DELAY, memory=None, scene=None, recorder=None, verbose=True,
+        frame_timeout=5.0):
+    """
+    Runs the agent loop.
+
+    Args:
+        llm: The OpenAIModel.
+        droidcam: Frame source, a DroidCamHandler or a replay.fakes.ReplayDroidCam.
+        iterations: Steps to run.
+        step_delay: Seconds to sleep after every step.
+        memory: MemoryManager holding the conversation, a new one by default.
+        scene: SceneChangeDetector deciding which steps reuse the last response, a new one by default.
+        recorder: replay.recorder.SessionRecorder to record the steps to, if any.
+        verbose: Print the memory and the responses.
+        frame_timeout: Seconds a step waits for a new frame before it is given up.
+    """
+    memory = memory if memory is not None else MemoryManager()
+    scene = scene if scene is not None else SceneChangeDetector()
+    skipped_steps = 0
+    response = None
+
+    for i in range(iterations):
+        with iteration(i):
+            # A frame captured after the previous step, so never one from before the robot moved
+            frame = droidcam.get_frame(after_seq=droidcam.frames.seq, timeout=frame_timeout)
+            if frame is None:
+                time.sleep(min(1, step_delay))
+                continue
+            with span("scene.signature"):
+                signature = scene.signature(frame.image)
+            image = frame.image.copy() if recorder is not None else None  # The ring slot gets reused
+
+            # Skip the LLM call if the view did not change since the last completed step
+            if scene.is_unchanged(signature) and skipped_steps < MAX_SKIPPED_STEPS:
+                skipped_steps += 1
+                if recorder is not None:
+                    recorder.record_step(i, image, [], skipped=True)
+                if verbose:
+                    print(f"\n\nScene unchanged, reusing model response: {response}")
+                    print("Sleeping...")
+                with span("main.sleep"):
+                    time.sleep(step_delay)
+                continue
+            skipped_steps = 0
+
+            new_iteration_messages = build_step_messages(droidcam, frame, llm.robot)
+            if new_iteration_messages is None:
+                time.sleep(min(1, step_delay))  # Encoding failed, try again with the next frame
+                continue
+
+            # Step 2: Pass stored memory + new iteration messages to LLM
+            input_messages = memory.get_memory_as_messages() + new_iteration_messages
+            sent = len(input_messages)  # complete() appends the model's turns to the list
+            with span("llm.complete"):
+                response, messages = llm.complete(messages=input_messages)
+
+            # Step 3: Store the full step in memory
+            with span("memory.add_iteration"):
+                memory.add_iteration(messages)
+            scene.commit(signature)
+            if recorder is not None:
+                recorder.record_step(i, image, messages[sent:])
+
+            if verbose:
+                memory.print_memory()
+                print(f"\n\nModel response: {response}")
+                print("Sleeping...")
+            with span("main.sleep"):
+                time.sleep(step_delay)
+
+
+# The frame, scene signature and JPEG of the next step, prepared while the robot stood still
+Prepared = namedtuple("Prepared", ["frame", "signature", "jpeg", "motion_epoch", "captured"])
+
+
+class FramePrefetcher:
+    """
+    Captures and encodes the frame of the next step in the background, while the model
+    call and the robot actions of the current step are still in flight.
+
+    A frame is only prepared once no motion is in flight, and it must be newer than the
+    moment the robot stopped, so the model never sees the world mid-motion. A prepared
+    frame is thrown away when the robot moves again or it gets older than `max_age`.
+    """
+
+    POLL_INTERVAL = 0.02  # How often a prepared frame is checked for motions that made it stale
+
+    def __init__(self, droidcam, robot, scene, max_age=2.0, frame_timeout=1.0, motion_timeout=30.0):
+        """
+        Args:
+            droidcam: Frame source, a DroidCamHandler or a replay.fakes.ReplayDroidCam.
+            robot: RobotController whose motions invalidate prepared frames.
+            scene: SceneChangeDetector computing the signatures.
+            max_age: Seconds after which a prepared frame is replaced by a fresh one, None keeps it.
+            frame_timeout: Seconds to wait for a new frame from the camera.
+            motion_timeout: Seconds to wait for the robot to stand still before trying again.
+        """
+        self.droidcam = droidcam
+        self.robot = robot
+        self.scene = scene
+        self.max_age = max_age
+        self.frame_timeout = frame_timeout
+        self.motion_timeout = motion_timeout
+        self._prepared = None
+        self._changed = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._prepare_frames, name="prefetch", daemon=True)
+        self._thread.start()
+
+    def _valid(self, prepared) -> bool:
+        return (prepared is not None and prepared.motion_epoch == self.robot.motion_epoch
+                and (self.max_age is None or time.monotonic() - prepared.captured < self.max_age))
+
+    def _prepare_frames(self):
+        while not self._closed:
+            # Rate control: wait until the robot reports it stands still (acks, then telemetry for other clients)
+            if not self.robot.wait_for_motions(self.motion_timeout):
+                continue
+            if self.robot.moving:
+                self.robot.wait_until_idle(self.motion_timeout)
+                continue
+            epoch = self.robot.motion_epoch
+
+            with span("prefetch.prepare") as prepare_span:
+                # A frame captured after the robot stopped
+                frame = self.droidcam.get_frame(after_seq=self.droidcam.frames.seq, timeout=self.frame_timeout)
+                # Not logged yet, the step may never use it
+                jpeg = None if frame is None else self.droidcam.encode_snapshot(snapshot=frame, persist=False)
+                if jpeg is None:
+                    time.sleep(self.POLL_INTERVAL)
+                    continue
+                prepared = Prepared(frame=frame, signature=self.scene.signature(frame.image), jpeg=jpeg,
+                                    motion_epoch=epoch, captured=time.monotonic())
+                if self.robot.motion_epoch != epoch:
+                    prepare_span.set(stale=True)
+                    continue  # The robot started moving while we captured
+
+            with self._changed:
+                self._prepared = prepared
+                self._changed.notify_all()
+                # Keep it until a step takes it or it goes stale
+                while not self._closed and self._prepared is prepared and self._valid(prepared):
+                    self._changed.wait(self.POLL_INTERVAL)
+
+    def take(self, timeout=None, stop=None):
+        """
+        Waits for a valid prepared frame and hands it over.
+
+        Args:
+            timeout: Maximum time to wait in seconds, None waits until `stop` is set.
+            stop: threading.Event that ends the wait early.
+
+        Returns:
+            Prepared or None on timeout, stop or close.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while not self._valid(self._prepared):
+                if self._closed or (stop is not None and stop.is_set()):
+                    return None
+                remaining = self.POLL_INTERVAL if deadline is None else min(self.POLL_INTERVAL,
+                                                                             deadline - time.monotonic())
+                if remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+            prepared, self._prepared = self._prepared, None
+            self._changed.notify_all()
+            return prepared
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        self._thread.join(self.frame_timeout + 1)
+
+
+def run_pipelined(llm, droidcam, iterations=None, min_interval=MIN_STEP_INTERVAL, memory=None, scene=None,
+                  recorder=None, verbose=True, stop=None, max_frame_age=2.0, frame_timeout=5.0,
+                  max_reuse=MAX_RESPONSE_REUSE):
+    """
+    Runs the agent loop with the next frame captured and encoded while the current step is
+    in flight. Instead of sleeping a fixed time, a step starts as soon as the robot stands
+    still and a frame taken after it stopped is ready, but at most every `min_interval` seconds.
+
+    Args:
+        llm: The OpenAIModel.
+        droidcam: Frame source, a DroidCamHandler or a replay.fakes.ReplayDroidCam.
+        iterations: Steps to run, None runs until `stop` is set.
+        min_interval: Minimum seconds between the starts of two steps.
+        memory: MemoryManager holding the conversation, a new one by default.
+        scene: SceneChangeDetector deciding which steps reuse the last response, a new one by default.
+        recorder: replay.recorder.SessionRecorder to record the steps to, if any.
+        verbose: Print the memory and the responses.
+        stop: threading.Event ending the loop after the current step, e.g. set by a signal handler.
+        max_frame_age: Seconds after which a prepared frame is replaced, None keeps it (deterministic replays).
+        frame_timeout: Seconds a step waits for a frame before it is given up.
+        max_reuse: Seconds after the last model call during which an unchanged scene reuses its response.
+            Steps come much faster than in `run`, so this is limited by time rather than by skipped steps.
+    """
+    memory = memory if memory is not None else MemoryManager()
+    scene = scene if scene is not None else SceneChangeDetector()
+    stop = stop if stop is not None else threading.Event()
+    prefetcher = FramePrefetcher(droidcam, llm.robot, scene, max_age=max_frame_age)
+    last_model_call = time.monotonic()
+    response = None
+    next_start = 0.0
+
+    try:
+        i = 0
+        while (iterations is None or i < iterations) and not stop.is_set():
+            with iteration(i):
+                with span("main.wait_for_frame"):
+                    # Pace steps without a fixed sleep; the prefetcher keeps the frame fresh meanwhile
+                    if stop.wait(max(0.0, next_start - time.monotonic())):
+                        break
+                    prepared = prefetcher.take(timeout=frame_timeout, stop=stop)
+                next_start = time.monotonic() + min_interval
+                i += 1
+                if prepared is None:
+                    continue
+                image = prepared.frame.image.copy() if recorder is not None else None  # The ring slot gets reused
+
+                # Skip the LLM call if the view did not change since the last completed step
+                if scene.is_unchanged(prepared.signature) and time.monotonic() - last_model_call < max_reuse:
+                    if recorder is not None:
+                        recorder.record_step(i - 1, image, [], skipped=True)
+                    if verbose:
+                        print(f"\n\nScene unchanged, reusing model response: {response}")
+                    continue
+
+                droidcam.persist_snapshot(prepared.jpeg)  # Only snapshots the model sees are logged
+                new_iteration_messages = build_step_messages(droidcam, prepared.frame, llm.robot,
+                                                             image_message=camera_image_message(prepared.jpeg))
+                input_messages = memory.get_memory_as_messages() + new_iteration_messages
+                sent = len(input_messages)  # complete() appends the model's turns to the list
+                with span("llm.complete"):
+                    response, messages = llm.complete(messages=input_messages)
+                last_model_call = time.monotonic()
+
+                with span("memory.add_iteration"):
+                    memory.add_iteration(messages)
+                scene.commit(prepared.signature)
+                if recorder is not None:
+                    recorder.record_step(i - 1, image, messages[sent:])
+
+                if verbose:
+                    memory.print_memory()
+                    print(f"\n\nModel response: {response}")
+    finally:
+        prefetcher.close()
+
+
+def stop_on_signals():
+    """
+    Returns an Event set by the first SIGINT/SIGTERM, so the loop finishes its current step
+    and shuts down cleanly. A second signal interrupts right away.
+    """
+    stop = threading.Event()
+
+    def handle(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        print(f"\n{signal.Signals(signum).name} received, stopping after the current step (again to abort)...")
+        stop.set()
+
+    signal.signal(signal.SIGINT, handle)
+    signal.signal(signal.SIGTERM, handle)
+    return stop
+
+
+def main():
+    # Per-stage latencies, e.g. AGENT_TRACE=trace.jsonl (p50/p95 summary printed at exit)
+    if os.environ.get("AGENT_TRACE"):
+        enable_tracing(os.environ["AGENT_TRACE"])
+
+    llm = OpenAIModel(stream=True)
+    llm.robot.start_telemetry(rate=5)  # Motor positions and battery for the prompts
+
+    # Session to replay offline later, e.g. AGENT_RECORD=sessions/kitchen (see benchmarks/agent_replay.py)
+    recorder = None
+    if os.environ.get("AGENT_RECORD"):
+        from replay.recorder import SessionRecorder
+        recorder = SessionRecorder(os.environ["AGENT_RECORD"])
+        recorder.attach_robot(llm.robot)
+
+    droidcam = DroidCamHandler(ip_address=DROIDCAM_IP,
+                               log_level=LogLevel.SNAPSHOT,
+                               capture_mode=CaptureMode.GRAB)
+    time.sleep(1)
+
+    try:
+        run_pipelined(llm, droidcam, recorder=recorder, stop=stop_on_signals())
+    finally:
+        # Don't leave the robot driving (other clients keep the server from stopping it); close() would drop the stop
+        try:
+            llm.robot.submit("stop").result(llm.robot.heartbeat_timeout)
+        except Exception as e:
+            print(f"Could not stop the robot: {e}")
+        droidcam.close()
+        llm.robot.close()
+        llm.close()
+        if recorder is not None:
+            recorder.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Stand-ins for the camera and the E2B sandbox, fed from a recorded session.
+"""
+
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+
+import cv2
+
+from droidcam.buffer import FrameRing
+from droidcam.core import encode_frame, to_data_url
+
+
+class ReplayDroidCam:
+    """
+    Serves the frames of a recorded session through the DroidCamHandler interface used by
+    the agent loop. Every frame request moves on to the next recorded frame, so a replay
+    sees the same frames in the same order as the recording.
+    """
+
+    def __init__(self, steps: list, preload: bool = True, buffer_size: int = 4, loop: bool = False):
+        """
+        Args:
+            steps: Recorded steps, see replay.recorder.load_session.
+            preload: Decode all frames up front, so replays measure the agent and not JPEG decoding.
+            buffer_size: Capacity of the frame ring.
+            loop: Start over at the end of the recording instead of running out of frames, e.g.
+                  for main.run_pipelined, whose prefetcher may capture more frames than it uses.
+        """
+        self.loop = loop
+        self.paths = [step["frame"] for step in steps]
+        self.images = [cv2.imread(path) for path in self.paths] if preload else None
+        self.frames = FrameRing(buffer_size)
+        self.last_snapshot_seq = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @property
+    def exhausted(self) -> bool:
+        return not self.loop and self._next >= len(self.paths)
+
+    def _advance(self):
+        """Commits the next recorded frame. Returns False at the end of the recording."""
+        with self._lock:
+            if self.exhausted:
+                return False
+            index = self._next % len(self.paths)
+            image = self.images[index] if self.images is not None else cv2.imread(self.paths[index])
+            self._next += 1
+            slot = self.frames.next_slot(image.shape)
+            slot[...] = image
+            self.frames.commit(slot)
+            return True
+
+    @property
+    def latest_frame(self):
+        frame = self.frames.latest()
+        return None if frame is None else frame.image
+
+    def wait_for_frame(self, after_seq: int = 0, timeout: float = None):
+        if self.frames.seq <= after_seq and not self._advance():
+            return None
+        return self.frames.wait_for_frame(after_seq, 0)
+
+    def get_frame(self, after_seq: int = None, timeout: float = 1.0):
+        if after_seq is None:
+            return self.frames.latest() if self._advance() else None
+        return self.wait_for_frame(after_seq, timeout)
+
+    def encode_snapshot(self, quality: int = 80, max_size: int = 512, data_url: bool = False,
+                        after_seq: int = None, timeout: float = 1.0, snapshot=None, persist: bool = True):
+        if snapshot is None:
+            snapshot = self.get_frame(after_seq, timeout)
+            if snapshot is None:
+                return None
+
+        self.last_snapshot_seq = snapshot.seq
+        jpeg = encode_frame(snapshot.image, quality=quality, max_size=max_size)
+        if data_url and jpeg is not None:
+            return to_data_url(jpeg)
+        return jpeg
+
+    def persist_snapshot(self, jpeg: bytes):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeSandbox:
+    """
+    Minimal stand-in for e2b_code_interpreter.Sandbox (see SandboxPool's `factory`).
+
+    Returns recorded outputs keyed by code instead of running anything remotely.
+    """
+
+    def __init__(self, results: dict = None, default: str = None, startup_delay: float = 0.0,
+                 run_delay: float = 0.0):
+        """
+        Args:
+            results: Code -> text the execution returns.
+            default: Text returned for code without a recorded result.
+            startup_delay: Simulated boot time in seconds.
+            run_delay: Simulated execution time in seconds.
+        """
+        time.sleep(startup_delay)
+        self.results = results or {}
+        self.default = default
+        self.run_delay = run_delay
+        self.killed = False
+        self._contexts = itertools.count(1)
+
+    def run_code(self, code, timeout=None, on_stdout=None, on_stderr=None, **kwargs):
+        if self.killed:
+            raise RuntimeError("Sandbox was shut down")
+        time.sleep(self.run_delay)
+        return SimpleNamespace(text=self.results.get(code, self.default), error=None,
+                               logs=SimpleNamespace(stdout=[], stderr=[]))
+
+    def create_code_context(self, **kwargs):
+        return SimpleNamespace(id=f"context-{next(self._contexts)}")
+
+    def remove_code_context(self, context):
+        pass
+
+    def set_timeout(self, timeout):
+        pass
+
+    def kill(self):
+        self.killed = True
@@ -0,0 +1,139 @@
+"""
+Local OpenAI-compatible endpoint that answers chat completions with recorded assistant turns.
+
+Point OpenAIModel at it with `base_url=server.base_url`. Turns are served in recording
+order regardless of the request, as a JSON completion or, for `stream=True` requests, as
+server-sent events split into chunks like the real API does.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockOpenAIServer:
+    """Serves recorded turns ({"content", "tool_calls": [[id, name, arguments], ...]}) in order."""
+
+    def __init__(self, turns: list, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 chunk_delay: float = 0.0):
+        """
+        Args:
+            turns: Assistant turns to answer with, see replay.recorder.
+            host: Interface to listen on.
+            port: Port to listen on, 0 picks a free one.
+            latency: Simulated time to the first token in seconds.
+            chunk_delay: Simulated delay between streamed chunks in seconds.
+        """
+        self.turns = list(turns)
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.request_sizes = []  # Bytes of every request body, e.g. to catch prompt growth
+        self._next = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reset(self):
+        """Starts serving the turns from the beginning again."""
+        with self._lock:
+            self._next = 0
+            self.request_sizes = []
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_turn(self, request_size: int) -> dict:
+        with self._lock:
+            self.request_sizes.append(request_size)
+            if self._next >= len(self.turns):
+                return {"content": "", "tool_calls": []}  # The recording is over, end the conversation
+            turn = self.turns[self._next]
+            self._next += 1
+            return turn
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                request = json.loads(body)
+                turn = server._next_turn(len(body))
+                time.sleep(server.latency)
+                if request.get("stream"):
+                    self._send_events(completion_chunks(turn, request.get("model", "")))
+                else:
+                    self._send_json(200, completion(turn, request.get("model", "")))
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_events(self, chunks):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in chunks + ["[DONE]"]:
+                    data = f"data: {chunk if isinstance(chunk, str) else json.dumps(chunk)}\n\n".encode()
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                    time.sleep(server.chunk_delay)
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+def _finish_reason(turn: dict) -> str:
+    return "tool_calls" if turn["tool_calls"] else "stop"
+
+
+def completion(turn: dict, model: str) -> dict:
+    """A chat.completion response for `turn`."""
+    message = {"role": "assistant", "content": turn["content"]}
+    if turn["tool_calls"]:
+        message["tool_calls"] = [{"id": id, "type": "function", "function": {"name": name, "arguments": arguments}}
+                                 for id, name, arguments in turn["tool_calls"]]
+    return {"id": "chatcmpl-replay", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": _finish_reason(turn)}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
+
+
+def completion_chunks(turn: dict, model: str) -> list:
+    """The chat.completion.chunk events streaming `turn`. Tool arguments arrive in two halves."""
+    def chunk(delta, finish_reason=None):
+        return {"id": "chatcmpl-replay", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+    chunks = [chunk({"role": "assistant", "content": ""})]
+    if turn["content"]:
+        words = turn["content"].split(" ")
+        chunks.extend(chunk({"content": word + " "}) for word in words[:-1])
+        chunks.append(chunk({"content": words[-1]}))
+    for index, (id, name, arguments) in enumerate(turn["tool_calls"]):
+        half = len(arguments) // 2
+        chunks.append(chunk({"tool_calls": [{"index": index, "id": id, "type": "function",
+                                             "function": {"name": name, "arguments": arguments[:half]}}]}))
+        chunks.append(chunk({"tool_calls": [{"index": index, "function": {"arguments": arguments[half:]}}]}))
+    chunks.append(chunk({}, _finish_reason(turn)))
+    return chunks
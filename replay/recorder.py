@@ -0,0 +1,97 @@
+"""
+Records agent sessions for offline replay (see benchmarks/agent_replay.py).
+
+A session directory holds
+
+    frames/<step>.jpg   the raw camera frame of every step (before rotation and resizing)
+    session.jsonl       one line per step: the assistant turns and tool results
+    robot.jsonl         one line per robot command: status, detail and round trip time
+"""
+
+import json
+import os
+import threading
+import time
+
+import cv2
+
+
+class SessionRecorder:
+    """Writes the steps of the agent loop and the robot commands to a session directory."""
+
+    def __init__(self, directory: str, frame_quality: int = 95):
+        self.directory = directory
+        self.frame_quality = frame_quality
+        os.makedirs(os.path.join(directory, "frames"), exist_ok=True)
+        self._steps = open(os.path.join(directory, "session.jsonl"), "a", buffering=1)
+        self._robot = open(os.path.join(directory, "robot.jsonl"), "a", buffering=1)
+        self._robot_lock = threading.Lock()  # Robot commands finish on the reader thread
+        self._step_count = len(os.listdir(os.path.join(directory, "frames")))  # Continue earlier recordings
+
+    def record_step(self, index: int, image, new_messages: list, skipped: bool = False):
+        """
+        Records one step of the agent loop.
+
+        Args:
+            index: Index of the step in the loop.
+            image: The BGR frame the step was based on.
+            new_messages: The assistant and tool Messages the step added to the conversation.
+            skipped: The step reused the previous response (unchanged scene).
+        """
+        frame = os.path.join("frames", f"{self._step_count:06d}.jpg")
+        cv2.imwrite(os.path.join(self.directory, frame), image, [cv2.IMWRITE_JPEG_QUALITY, self.frame_quality])
+        self._step_count += 1
+
+        step = {
+            "index": index,
+            "time": time.time(),
+            "frame": frame,
+            "skipped": skipped,
+            "turns": [{"content": message.content, "tool_calls": [list(call) for call in message.tool_calls or ()]}
+                      for message in new_messages if message.role == "assistant"],
+            "tool_results": [{"tool_call_id": message.tool_call_id, "name": message.name, "content": message.content}
+                             for message in new_messages if message.role == "tool"],
+        }
+        self._steps.write(json.dumps(step, default=str) + "\n")
+
+    def attach_robot(self, robot):
+        """Records every command `robot` (a RobotController) sends from now on."""
+        submit = robot.submit
+
+        def recording_submit(command, *args, **kwargs):
+            start = time.perf_counter()
+            future = submit(command, *args, **kwargs)
+            future.add_done_callback(lambda done: self._record_command(command, done, time.perf_counter() - start))
+            return future
+
+        robot.submit = recording_submit
+
+    def _record_command(self, command, future, duration):
+        if future.cancelled():
+            status, detail = "cancelled", ""
+        elif future.exception() is not None:
+            status, detail = "err", str(future.exception())
+        else:
+            status, detail = "ok", future.result()
+        with self._robot_lock:
+            self._robot.write(json.dumps({"time": time.time(), "command": command, "status": status,
+                                          "detail": detail, "duration": duration}) + "\n")
+
+    def close(self):
+        self._steps.close()
+        with self._robot_lock:
+            self._robot.close()
+
+
+def load_session(directory: str) -> list:
+    """
+    Returns:
+        list: The recorded steps as dicts, with "frame" as an absolute path.
+    """
+    steps = []
+    with open(os.path.join(directory, "session.jsonl")) as file:
+        for line in file:
+            step = json.loads(line)
+            step["frame"] = os.path.join(directory, step["frame"])
+            steps.append(step)
+    return steps
@@ -2,23 +2,65 @@
 Server running on the ev3 brick.
 
 - Receives commands and executes them on the robot.
+- Serves any number of clients at once (e.g. the agent plus a teleop/debug console) and
+  keeps accepting new connections when a client drops.
+- Reports back to the client when each command has finished.
+- Schedules motion and audio on separate channels, so speech does not block driving and
+  a `stop` (or a new motion) interrupts the current motion immediately.
+- Caches speech rendered by espeak as WAV files, so repeated phrases start playing at once.
+- Streams telemetry (motor positions, speeds and states, battery voltage) to clients that
+  subscribe with `telemetry <hz>`.
+
+`python server.py --sim` (or EV3_SIM=1) runs it on any Linux box with the simulated motors
+and sound of ev3sim.py instead of ev3dev2, e.g. for load tests (benchmarks/ev3_server_load.py)
+and, with `--time-scale`, faster than real time for replays (benchmarks/agent_replay.py).
+
+Runs on the brick's Python 3.5, so no f-strings here.
 """
 
+import argparse
+import collections
+import hashlib
+import json
+import os
+import queue
 import socket
+import subprocess
 import threading
-from ev3dev2.motor import MoveTank, OUTPUT_B, OUTPUT_C, OUTPUT_D, SpeedPercent, MediumMotor
-from ev3dev2.sound import Sound
+import time
+
+parser = argparse.ArgumentParser(description="Command server of the EV3 robot")
+parser.add_argument("--sim", action="store_true", default=bool(os.environ.get("EV3_SIM")),
+                    help="Simulate the motors and sound (ev3sim.py) instead of using ev3dev2")
+parser.add_argument("--port", type=int, default=12345)
+parser.add_argument("--time-scale", type=float, default=1.0,
+                    help="With --sim, real seconds per simulated second, e.g. 0.01 for replays at 100x speed")
+args = parser.parse_args()
+
+# Real seconds per second of robot time, only ever changed in simulation
+time_scale = 1.0
+if args.sim:
+    import ev3sim
+    from ev3sim import MoveTank, OUTPUT_B, OUTPUT_C, OUTPUT_D, SpeedPercent, MediumMotor, PowerSupply, Sound
+    ev3sim.set_time_scale(args.time_scale)
+    time_scale = args.time_scale
+else:
+    from ev3dev2.motor import MoveTank, OUTPUT_B, OUTPUT_C, OUTPUT_D, SpeedPercent, MediumMotor
+    from ev3dev2.power import PowerSupply
+    from ev3dev2.sound import Sound
 
 # Initialize motors and sound
 tank_drive = MoveTank(OUTPUT_B, OUTPUT_C)
 medium_motor = MediumMotor(OUTPUT_D)  # Initialize the medium motor on port D
 sound = Sound()
+power_supply = PowerSupply()
 
 # Create a server socket
 server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server_socket.bind(("0.0.0.0", 12345))  # Listen on all interfaces, port 12345
-server_socket.listen(1)
-print("EV3 Server Started! Waiting for commands...")
+server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Allow quick restarts
+server_socket.bind(("0.0.0.0", args.port))  # Listen on all interfaces, port 12345 by default
+server_socket.listen(5)
+print("EV3 Server Started" + (" (simulated)" if args.sim else "") + "! Waiting for commands...")
 
 
 # Define playsound mappings
@@ -27,104 +69,547 @@ playsound_paths = {
     "intro": "/home/robot/myproject/intro.wav"
 }
 
+# Wheel speeds (left, right) of the movement commands
+drive_speeds = {
+    "forward": (-30, -30),
+    "backward": (30, 30),
+    "left": (-20, 20),
+    "right": (20, -20),
+}
+
+# How often blocking waits check whether they were cancelled
+POLL_INTERVAL = 0.02
+
+# Rendered speech, see SpeechCache
+SPEECH_CACHE_DIR = "/home/robot/myproject/speech_cache"
+SPEECH_CACHE_MAX_BYTES = 32 * 1024 * 1024
+ESPEAK_OPTIONS = ["-a", "200", "-s", "130"]  # Same voice as Sound.speak()
+
+# Rendered in the background at startup
+common_phrases = [
+    "Hello",
+    "Time to dance",
+    "I see a wall",
+    "I found a problem to solve",
+    "The answer is",
+]
+
+# Every telemetry sample reads a few sysfs files, don't let a client saturate the brick
+MAX_TELEMETRY_RATE = 20.0
+
+
+class Cancelled(Exception):
+    """Raised inside an action when it was preempted."""
+
+
+class Job:
+    """A scheduled action together with the callback reporting its outcome."""
+
+    def __init__(self, name, action, reply):
+        self.name = name
+        self.action = action  # Called with the job's cancel event
+        self.reply = reply  # Called with (status, detail) exactly once
+        self.cancel = threading.Event()
+        self.generation = 0
+
+
+class Channel:
+    """
+    Runs jobs for one resource (motion or audio) one after another in its own thread.
+
+    Jobs on different channels run concurrently. `preempt` cancels the running job and
+    every job queued so far.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.jobs = queue.Queue()
+        self.current = None
+        self.generation = 0  # Bumped by preempt(); jobs submitted before that are stale
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self._run, name=name)
+        thread.daemon = True
+        thread.start()
+
+    def submit(self, job):
+        with self.lock:
+            job.generation = self.generation
+        self.jobs.put(job)
+
+    def preempt(self):
+        with self.lock:
+            self.generation += 1
+            if self.current is not None:
+                self.current.cancel.set()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            with self.lock:
+                stale = job.generation != self.generation
+                if not stale:
+                    self.current = job
+            if stale:
+                job.reply("err", "Cancelled")
+                continue
+
+            try:
+                job.action(job.cancel)
+                job.reply("ok", job.name)
+            except Cancelled:
+                print("Cancelled:", job.name)
+                job.reply("err", "Cancelled")
+            except Exception as e:
+                print("Error executing", job.name, e)
+                job.reply("err", str(e))
+            finally:
+                with self.lock:
+                    self.current = None
+
+
+motion = Channel("motion")
+audio = Channel("audio")
+
 
-# Function to play sound file in a separate thread
-def play_sound_file(filename):
+def wait_or_cancel(cancel, duration):
+    """Sleeps for `duration` seconds of robot time, raising Cancelled as soon as `cancel` is set."""
+    if cancel.wait(duration * time_scale):
+        raise Cancelled()
+
+
+def drive(left, right, duration, cancel):
+    tank_drive.on(SpeedPercent(left), SpeedPercent(right))
     try:
-        sound.play_file(filename)
-        print("Finished playing")
-    except Exception as e:
-        print("Error playing sound file", e)
+        wait_or_cancel(cancel, duration)
+    finally:
+        tank_drive.off()
 
 
-# Accept a connection
-client_socket, client_address = server_socket.accept()
-print("Connected to", client_address)
+def spin_medium_motor(speed, duration, cancel):
+    medium_motor.on(SpeedPercent(speed))
+    try:
+        wait_or_cancel(cancel, duration)
+    finally:
+        medium_motor.off()
 
-# Command handling loop
-try:
-    while True:
-        command = client_socket.recv(1024).decode().strip()  # Receive command
-        if not command:
-            continue  # If empty, keep listening
 
-        print("Received command:", command)
+def play(start, cancel):
+    """Runs a sound started by `start(play_type)` until it ends or is cancelled."""
+    process = start(Sound.PLAY_NO_WAIT_FOR_COMPLETE)
+    while process.poll() is None:
+        if cancel.wait(POLL_INTERVAL):
+            process.terminate()
+            raise Cancelled()
+
+
+class SpeechCache:
+    """
+    Content-addressed cache of speech rendered to WAV files by espeak.
+
+    Files are named after the sha1 of the voice options and the normalized text. The least
+    recently used files are deleted once the cache grows beyond `max_bytes`.
+    """
+
+    def __init__(self, directory, max_bytes, espeak_options):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.espeak_options = espeak_options
+        self.lock = threading.Lock()
+        self.files = collections.OrderedDict()  # Path -> size, least recently used first
+        self.size = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Pick up the files of earlier runs, oldest first
+        paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".wav")]
+        for path in sorted(paths, key=os.path.getmtime):
+            self.files[path] = os.path.getsize(path)
+            self.size += self.files[path]
+        self.evict()
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(text.split())
+
+    def path(self, text):
+        key = " ".join(self.espeak_options) + "\n" + self.normalize(text)
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".wav")
 
-        # Split the command string by spaces
-        parts = command.split()
-        cmd = parts[0]
+    def get(self, text, cancel=None, nice=0):
+        """
+        Returns the WAV file of `text`, rendering it first on a cache miss. Raises Cancelled
+        if `cancel` is set while rendering.
+        """
+        path = self.path(text)
+        with self.lock:
+            if path in self.files:
+                self.files.move_to_end(path)
+                return path
+        cancel = cancel or threading.Event()
 
-        # Check if there's an optional time parameter for movement commands
-        duration = 2  # Default duration
-        if len(parts) > 1 and cmd in ["forward", "backward", "left", "right"]:
+        # Render to a temporary file, so a cancelled or concurrent render never leaves a partial file
+        temporary = path + "." + str(threading.get_ident()) + ".tmp"
+        process = subprocess.Popen(["espeak"] + self.espeak_options + ["-w", temporary, self.normalize(text)],
+                                   preexec_fn=(lambda: os.nice(nice)) if nice else None)
+        try:
+            while process.poll() is None:
+                if cancel.wait(POLL_INTERVAL):
+                    process.terminate()
+                    raise Cancelled()
+            if process.returncode != 0:
+                raise RuntimeError("espeak failed with exit code " + str(process.returncode))
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+        with self.lock:
+            if path not in self.files:
+                self.files[path] = os.path.getsize(path)
+                self.size += self.files[path]
+            self.files.move_to_end(path)
+            self.evict()
+        return path
+
+    def evict(self):
+        """Deletes least recently used files until the cache fits. Keeps the newest file."""
+        while self.size > self.max_bytes and len(self.files) > 1:
+            path, size = self.files.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def prerender(self, phrases):
+        """Renders `phrases` at low priority, so it does not slow down the robot."""
+        for phrase in phrases:
             try:
-                duration = float(parts[1])
-            except ValueError:
-                # If conversion fails, use default
-                print("Invalid time parameter. Using default 2 seconds.")
-
-        # Movement commands with optional duration parameter
-        if cmd == "forward":
-            tank_drive.on_for_seconds(SpeedPercent(-30), SpeedPercent(-30), duration)
-
-        elif cmd == "backward":
-            tank_drive.on_for_seconds(SpeedPercent(30), SpeedPercent(30), duration)
-
-        elif cmd == "left":
-            tank_drive.on_for_seconds(SpeedPercent(-20), SpeedPercent(20), duration)
-
-        elif cmd == "right":
-            tank_drive.on_for_seconds(SpeedPercent(20), SpeedPercent(-20), duration)
-
-        elif cmd == "stop":
-            tank_drive.off()
-
-        # Dance command using the medium motor on port D
-        elif cmd == "dance":
-            # Make a simple dance routine using the medium motor and tank drive
-            sound.speak("Time to dance")
-
-            # Spin the medium motor back and forth
-            for _ in range(2):
-                medium_motor.on_for_seconds(SpeedPercent(50), 0.5)
-                medium_motor.on_for_seconds(SpeedPercent(-50), 0.5)
-
-            # Final pose
-            tank_drive.off()
-            medium_motor.off()
-            sound.beep()
-
-        elif cmd == "beep":
-            sound.beep()
-
-        elif command.startswith("say: "):
-            text_to_say = command[5:]  # Remove "say: " prefix
-            print("Saying:", text_to_say)
-            sound.speak(text_to_say)
-
-        elif cmd == "playsound":
-            if len(parts) > 1:
-                sound_flag = parts[1]
-                sound_file = playsound_paths.get(sound_flag, None)
-                if sound_file:
-                    print("Playing sound")
-                    sound_thread = threading.Thread(target=play_sound_file, args=(sound_file,))
-                    sound_thread.daemon = True
-                    sound_thread.start()
-                else:
-                    print("Invalid sound flag. Available flags: oiai, intro")
+                self.get(phrase, nice=10)
+            except Exception as e:
+                print("Could not prerender", repr(phrase), e)
+
+
+if args.sim:
+    speech_cache = None  # There is no espeak to render with, the simulated Sound times the speech itself
+else:
+    speech_cache = SpeechCache(SPEECH_CACHE_DIR, SPEECH_CACHE_MAX_BYTES, ESPEAK_OPTIONS)
+    prerender_thread = threading.Thread(target=speech_cache.prerender, args=(common_phrases,), name="prerender")
+    prerender_thread.daemon = True
+    prerender_thread.start()
+
+
+def say(text, cancel):
+    """Speaks `text` from the speech cache, rendering it first if it is not cached yet."""
+    if speech_cache is None:
+        play(lambda t: sound.speak(text, espeak_opts=" ".join(ESPEAK_OPTIONS), play_type=t), cancel)
+        return
+    path = speech_cache.get(text, cancel)
+    play(lambda t: sound.play_file(path, play_type=t), cancel)
+
+
+def wait_until_stopped(cancel):
+    """Waits until both drive motors reached their target, raising Cancelled if preempted."""
+    while tank_drive.left_motor.is_running or tank_drive.right_motor.is_running:
+        if cancel.wait(POLL_INTERVAL):
+            raise Cancelled()
+
+
+def read_telemetry():
+    """Samples the motors and the battery."""
+    motors = {}
+    for port, motor in (("B", tank_drive.left_motor), ("C", tank_drive.right_motor), ("D", medium_motor)):
+        motors[port] = {"position": motor.position, "speed": motor.speed, "state": motor.state}
+    sample = {"motors": motors, "battery_volts": round(power_supply.measured_volts, 2)}
+    if args.sim:
+        sample["sim_pose"] = [round(value, 1) for value in tank_drive.pose]  # Ground truth for the odometry
+    return sample
+
+
+def parse_trajectory(payload):
+    """Validates a JSON list of motion segments (see RobotController.move_sequence)."""
+    segments = json.loads(payload)
+    if not isinstance(segments, list) or not segments:
+        raise ValueError("Trajectory must be a non-empty list of segments")
+    for segment in segments:
+        direction = segment.get("direction")
+        if direction != "pause" and direction not in drive_speeds:
+            raise ValueError("Invalid trajectory direction: " + str(direction))
+        if direction == "pause" and "duration" not in segment:
+            raise ValueError("Pause segments need a duration")
+        if "duration" not in segment and "degrees" not in segment:
+            raise ValueError("Trajectory segments need a duration or degrees")
+    return segments
+
+
+def run_trajectory(segments, cancel):
+    """
+    Drives the segments back-to-back. Timed segments only change the wheel speeds, so
+    the robot does not stop between them.
+    """
+    try:
+        for segment in segments:
+            direction = segment["direction"]
+            if direction == "pause":
+                tank_drive.off()
+                wait_or_cancel(cancel, float(segment["duration"]))
+                continue
+
+            # Scale the direction's wheel speed pattern to the requested speed
+            left, right = drive_speeds[direction]
+            speed = float(segment.get("speed", abs(left)))
+            left, right = speed * (1 if left > 0 else -1), speed * (1 if right > 0 else -1)
+
+            if "degrees" in segment:
+                tank_drive.on_for_degrees(SpeedPercent(left), SpeedPercent(right), float(segment["degrees"]),
+                                          brake=False, block=False)
+                wait_until_stopped(cancel)
             else:
-                print("Missing sound flag. Usage: playsound <flag>")
+                tank_drive.on(SpeedPercent(left), SpeedPercent(right))
+                wait_or_cancel(cancel, float(segment["duration"]))
+    finally:
+        tank_drive.off()
+
+
+def dance(cancel):
+    # Make a simple dance routine using the medium motor and tank drive
+    audio.submit(Job("say: Time to dance", lambda c: say("Time to dance", c), lambda status, detail: None))
+
+    # Spin the medium motor back and forth
+    for _ in range(2):
+        spin_medium_motor(50, 0.5, cancel)
+        spin_medium_motor(-50, 0.5, cancel)
+
+    # Final pose
+    tank_drive.off()
+    medium_motor.off()
+    audio.submit(Job("beep", lambda c: play(lambda t: sound.beep(play_type=t), c), lambda status, detail: None))
+
+
+def schedule_command(command, reply):
+    """
+    Parses a command and schedules it on its channel. `reply(status, detail)` is
+    called once the command has finished, failed or was cancelled.
+
+    Returns:
+        False if the server should stop, True otherwise.
+    """
+    print("Received command:", command)
+
+    # Split the command string by spaces
+    parts = command.split()
+    cmd = parts[0]
+
+    # Check if there's an optional time parameter for movement commands
+    duration = 2  # Default duration
+    if len(parts) > 1 and cmd in drive_speeds:
+        try:
+            duration = float(parts[1])
+        except ValueError:
+            # If conversion fails, use default
+            print("Invalid time parameter. Using default 2 seconds.")
+
+    # Movement commands with optional duration parameter. A new motion replaces the current one.
+    if cmd in drive_speeds:
+        left, right = drive_speeds[cmd]
+        motion.preempt()
+        motion.submit(Job(command, lambda cancel: drive(left, right, duration, cancel), reply))
+
+    # A whole motion sequence as JSON, e.g. trajectory [{"direction": "forward", "speed": 30, "duration": 1.5}]
+    elif cmd == "trajectory":
+        segments = parse_trajectory(command[len("trajectory "):])
+        motion.preempt()
+        motion.submit(Job("trajectory (" + str(len(segments)) + " segments)",
+                          lambda cancel: run_trajectory(segments, cancel), reply))
+
+    elif cmd == "stop":
+        motion.preempt()
+        tank_drive.off()
+        medium_motor.off()
+        reply("ok", command)
+
+    # Dance command using the medium motor on port D
+    elif cmd == "dance":
+        motion.preempt()
+        motion.submit(Job(command, dance, reply))
+
+    elif cmd == "beep":
+        audio.submit(Job(command, lambda cancel: play(lambda t: sound.beep(play_type=t), cancel), reply))
+
+    elif command.startswith("say: "):
+        text_to_say = command[5:]  # Remove "say: " prefix
+        print("Saying:", text_to_say)
+        audio.submit(Job(command, lambda cancel: say(text_to_say, cancel), reply))
+
+    elif cmd == "playsound":
+        if len(parts) < 2:
+            reply("err", "Missing sound flag. Usage: playsound <flag>")
+        elif parts[1] not in playsound_paths:
+            reply("err", "Invalid sound flag. Available flags: oiai, intro")
+        else:
+            print("Playing sound")
+            sound_file = playsound_paths[parts[1]]
+            audio.submit(Job(command, lambda cancel: play(lambda t: sound.play_file(sound_file, play_type=t), cancel),
+                             reply))
+
+    elif cmd == "quit":
+        motion.preempt()
+        audio.preempt()
+        reply("ok", command)
+        return False  # Stop the server
+
+    else:
+        reply("err", "Unknown command: " + cmd)
+
+    return True
 
-        elif cmd == "quit":
-            break  # Stop the server
 
-except ConnectionResetError:
-    print("Client disconnected.")
-except Exception as e:
-    print("Error:", e)
+class Client:
+    """One connected client (e.g. the agent or a teleop/debug console)."""
+
+    def __init__(self, client_socket, client_address):
+        self.socket = client_socket
+        self.address = client_address
+        self.send_lock = threading.Lock()  # Replies are sent from the channel threads
+        self.telemetry_stop = None  # Event stopping the current telemetry stream
+
+    def send_line(self, line):
+        try:
+            with self.send_lock:
+                self.socket.sendall(line.encode())
+            return True
+        except OSError as e:
+            print("Could not send to", self.address, e)
+            return False
+
+    def make_reply(self, request_id):
+        def reply(status, detail):
+            self.send_line(request_id + " " + status + " " + detail.replace("\n", " ") + "\n")
+        return reply
+
+    def stream_telemetry(self, rate):
+        """Pushes "0 telemetry <json>" lines `rate` times per second, replacing any earlier stream. 0 stops it."""
+        if self.telemetry_stop is not None:
+            self.telemetry_stop.set()
+            self.telemetry_stop = None
+        if rate <= 0:
+            return
+
+        stop = threading.Event()
+        self.telemetry_stop = stop
+        thread = threading.Thread(target=self._send_telemetry, args=(1.0 / min(rate, MAX_TELEMETRY_RATE), stop),
+                                  name="telemetry")
+        thread.daemon = True
+        thread.start()
+
+    def _send_telemetry(self, interval, stop):
+        seq = 0
+        next_sample = time.monotonic()
+        while True:
+            next_sample += interval
+            if stop.wait(max(0, next_sample - time.monotonic())):
+                return
+            try:
+                sample = read_telemetry()
+            except Exception as e:
+                print("Error reading telemetry:", e)
+                continue
+            seq += 1
+            sample["seq"] = seq
+            if not self.send_line("0 telemetry " + json.dumps(sample, separators=(",", ":")) + "\n"):
+                return
+
+
+clients = set()
+clients_lock = threading.Lock()
+
+
+def serve_client(client):
+    """
+    Command handling loop of one client. Every request is a line "<id> <command>" and is
+    answered with "<id> ok <command>" or "<id> err <message>" once the action has actually
+    finished (see llm_agent/ev3/protocol.py). Commands are only scheduled here, never
+    executed inline, so a `stop` is received even while the robot is driving.
+    """
+    buffer = b""
+    running = True
+    try:
+        while running:
+            data = client.socket.recv(4096)  # Receive commands
+            if not data:
+                break
+            buffer += data
+
+            while running and b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                request_id, _, command = line.decode().strip().partition(" ")
+                if not command:
+                    continue  # If empty, keep listening
+                if not request_id.isdigit():
+                    print("Malformed request:", line)
+                    continue
+
+                reply = client.make_reply(request_id)
+                if command == "ping":
+                    reply("ok", "pong")  # Heartbeat, answered right away
+                    continue
+
+                try:
+                    parts = command.split()
+                    if parts[0] == "telemetry":
+                        # Per client, e.g. "telemetry 5" for 5 samples per second, "telemetry 0" to stop
+                        client.stream_telemetry(float(parts[1]) if len(parts) > 1 else 0)
+                        reply("ok", command)
+                    else:
+                        running = schedule_command(command, reply)
+                except Exception as e:
+                    print("Error scheduling", command, e)
+                    reply("err", str(e))
+
+        if not running:
+            server_socket.close()  # `quit` stops the whole server
+
+    except OSError as e:
+        print("Connection error:", e)
+    except Exception as e:
+        print("Error:", e)
+
+    print("Client disconnected:", client.address)
+    client.stream_telemetry(0)
+    client.socket.close()
+    with clients_lock:
+        clients.discard(client)
+        last_client = not clients
+
+    # Nobody is left to send a `stop`, don't keep driving blind
+    if last_client:
+        motion.preempt()
+
+
+# Accept connections until `quit`
+try:
+    while True:
+        try:
+            client_socket, client_address = server_socket.accept()
+        except OSError:
+            break  # The server socket was closed
+
+        print("Connected to", client_address)
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = Client(client_socket, client_address)
+        with clients_lock:
+            clients.add(client)
+        client_thread = threading.Thread(target=serve_client, args=(client,))
+        client_thread.daemon = True
+        client_thread.start()
+except KeyboardInterrupt:
+    pass
 
 # Cleanup
-print("Closing connection...")
-client_socket.close()
-server_socket.close()
\ No newline at end of file
+print("Closing connections...")
+motion.preempt()
+audio.preempt()
+with clients_lock:
+    for client in clients:
+        client.socket.close()
+server_socket.close()
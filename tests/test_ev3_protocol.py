@@ -0,0 +1,70 @@
+"""Encoding and parsing of the line protocol between RobotController and server.py."""
+
+import pytest
+
+from llm_agent.ev3.protocol import (EVENT_ID, EVENT_TELEMETRY, STATUS_ERROR, STATUS_OK, LineReader, ProtocolError,
+                                    encode_reply, encode_request, parse_reply, parse_request)
+
+
+def test_request_round_trip():
+    line = encode_request(7, "forward 2.0")
+    assert line == b"7 forward 2.0\n"
+    assert parse_request(line.decode()) == (7, "forward 2.0")
+
+
+def test_request_keeps_spaces_in_the_command():
+    assert parse_request(encode_request(3, "say: Hello there").decode()) == (3, "say: Hello there")
+
+
+def test_request_with_newline_is_rejected():
+    with pytest.raises(ProtocolError):
+        encode_request(1, "say: one\nstop")
+
+
+@pytest.mark.parametrize("line", ["", "forward", "x forward", "-1 forward", "5", "5 "])
+def test_malformed_requests_are_rejected(line):
+    with pytest.raises(ProtocolError):
+        parse_request(line)
+
+
+def test_reply_round_trip():
+    assert parse_reply(encode_reply(7, STATUS_OK, "forward 2.0").decode()) == (7, STATUS_OK, "forward 2.0")
+    assert parse_reply(encode_reply(8, STATUS_ERROR, "Unknown command: fly").decode()) == \
+        (8, STATUS_ERROR, "Unknown command: fly")
+
+
+def test_reply_detail_stays_on_one_line():
+    line = encode_reply(2, STATUS_ERROR, "Traceback\nValueError")
+    assert line.count(b"\n") == 1
+    assert parse_reply(line.decode()) == (2, STATUS_ERROR, "Traceback ValueError")
+
+
+def test_reply_without_detail():
+    assert parse_reply("4 ok\n") == (4, STATUS_OK, "")
+
+
+def test_event_has_id_0():
+    line = f"{EVENT_ID} {EVENT_TELEMETRY} " + '{"battery": 7.9}\n'
+    assert parse_reply(line) == (0, EVENT_TELEMETRY, '{"battery": 7.9}')
+
+
+@pytest.mark.parametrize("line", ["", "ok\n", "x ok done\n", "7\n"])
+def test_malformed_replies_are_rejected(line):
+    with pytest.raises(ProtocolError):
+        parse_reply(line)
+
+
+def test_line_reader_keeps_partial_lines():
+    reader = LineReader()
+    assert reader.feed(b"1 ok for") == []
+    assert reader.feed(b"ward 2.0\n2 ok st") == ["1 ok forward 2.0"]
+    assert reader.feed(b"op\n\n3 ok ping\n") == ["2 ok stop", "", "3 ok ping"]
+    assert reader.feed(b"") == []
+
+
+def test_line_reader_joins_utf8_split_across_reads():
+    data = "1 ok say: Grüße\n".encode()
+    split = data.index("ü".encode()) + 1
+    reader = LineReader()
+    assert reader.feed(data[:split]) == []
+    assert reader.feed(data[split:]) == ["1 ok say: Grüße"]
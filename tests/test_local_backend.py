@@ -0,0 +1,122 @@
+"""Routing policy, LocalBackend workers and the guards of local_worker.py."""
+
+import time
+
+import pytest
+
+from llm_agent.e2b_sandbox.backends import ExecutionBackend, ExecutionResult, LocalBackend, RoutingBackend, prefers_local
+
+
+@pytest.fixture(scope="module")
+def backend():
+    backend = LocalBackend(workers=1, timeout=10.0, cpu_seconds=2)
+    yield backend
+    backend.close()
+
+
+class Remote(ExecutionBackend):
+    def __init__(self):
+        self.codes = []
+
+    def run(self, code, timeout=None, on_stdout=None, on_stderr=None):
+        self.codes.append(code)
+        return ExecutionResult("remote", "", "", None)
+
+
+@pytest.mark.parametrize("code", [
+    "2 ** 10",
+    "import math\nmath.factorial(20)",
+    "from fractions import Fraction\nFraction(1, 3) * 3",
+    "import collections.abc",
+    "def broken(:",
+])
+def test_short_stdlib_code_prefers_local(code):
+    assert prefers_local(code)
+
+
+@pytest.mark.parametrize("code", [
+    "import numpy as np",
+    "from pandas import DataFrame",
+    "import math, requests",
+    "from . import sibling",
+    "open('notes.txt').read()",
+    "__import__('os')",
+    "x = 1\n" * 1000,
+])
+def test_other_code_prefers_remote(code):
+    assert not prefers_local(code)
+
+
+def test_runs_code_like_a_notebook_cell(backend):
+    output = []
+    result = backend.run("print('hi')\nx = 6\nx * 7", on_stdout=output.append)
+    assert result == ExecutionResult("42", "hi\n", "", None)
+    assert output == ["hi\n"]
+
+
+def test_errors_are_reported_with_the_cell_traceback(backend):
+    result = backend.run("1 / 0")
+    assert result.error == "ZeroDivisionError: division by zero"
+    assert "local_worker" not in result.stderr
+    assert 'File "<cell>"' in result.stderr
+
+
+def test_runs_do_not_share_state(backend):
+    backend.run("x = 1")
+    assert backend.run("x").error == "NameError: name 'x' is not defined"
+
+
+def test_wall_clock_timeout_kills_the_worker(backend):
+    start = time.monotonic()
+    result = backend.run("import time\ntime.sleep(30)", timeout=0.5)
+    assert result.error.startswith("TimeoutError")
+    assert time.monotonic() - start < 5
+    assert backend.run("1 + 1").text == "2"
+
+
+def test_cpu_time_limit_ends_busy_loops(backend):
+    result = backend.run("while True: pass")
+    assert result.error == "TimeoutError: CPU time limit of 2 s exceeded"
+
+
+def test_a_fresh_worker_is_kept_ready_after_every_run():
+    backend = LocalBackend(workers=2)
+    try:
+        workers = list(backend._ready)
+        for i in range(3):
+            assert backend.run(f"{i} + 1").text == str(i + 1)
+            assert len(backend._ready) == 2
+        assert not set(workers) & set(backend._ready)
+        assert all(worker.returncode is not None for worker in workers)
+    finally:
+        backend.close()
+
+
+@pytest.mark.parametrize("code", [
+    "import socket\nsocket.socket()",
+    "import socket\nsocket.getaddrinfo('example.com', 80)",
+    "import subprocess\nsubprocess.run(['true'])",
+    "import os\nos.system('true')",
+    "open('out.txt', 'w')",
+    "import os\nos.open('out.txt', os.O_WRONLY | os.O_CREAT)",
+    "import os\nos.remove('/tmp')",
+])
+def test_audit_hook_blocks_network_processes_and_writes(backend, code):
+    assert backend.run(code).error.startswith("PermissionError")
+
+
+def test_reading_files_is_allowed(backend):
+    assert backend.run("import json\nlen(open(json.__file__).read()) > 0").text == "True"
+
+
+def test_routing_without_remote_refuses_non_local_code(backend):
+    result = RoutingBackend(backend).run("import numpy as np\nnp.ones(3).sum()")
+    assert result.error.startswith("RuntimeError: This code needs the E2B sandbox")
+
+
+def test_routing_sends_non_local_code_to_the_remote(backend):
+    remote = Remote()
+    routing = RoutingBackend(backend, remote)
+    assert routing.run("2 + 2").text == "4"
+    assert routing.run("import numpy").text == "remote"
+    assert remote.codes == ["import numpy"]
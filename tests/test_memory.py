@@ -0,0 +1,119 @@
+"""MemoryManager image demotion and trimming, and the size cap of execution results."""
+
+import os
+
+from llm_agent.e2b_sandbox.backends import ExecutionResult
+from llm_agent.e2b_sandbox.execute import format_result
+from llm_agent.memory import MemoryManager
+from llm_agent.messages import ImageRef, Message
+
+JPEG = b"\xff\xd8" + bytes(1000) + b"\xff\xd9"
+
+
+def step(memory, prompt, reply, image=True):
+    """Runs one agent iteration: a prompt (with a camera image) and the model's reply."""
+    parts = (prompt, ImageRef(data=JPEG)) if image else (prompt,)
+    messages = memory.get_memory_as_messages() + [Message.user(*parts), Message("assistant", reply)]
+    memory.add_iteration(messages)
+
+
+def images(memory):
+    return [len(message.images) for iteration in memory.iterations for message in iteration if message.role == "user"]
+
+
+def test_older_images_are_replaced_by_the_model_notes():
+    memory = MemoryManager(max_steps=5, token_budget=100000, keep_images=1)
+    step(memory, "step 1", "I see a red ball.")
+    step(memory, "step 2", "The ball is closer.")
+    assert images(memory) == [0, 1]
+    demoted = memory.iterations[0][0]
+    assert demoted.text == "step 1 [Earlier camera image omitted. The robot's notes on it: I see a red ball.]"
+
+
+def test_tool_calls_end_up_in_the_stub():
+    memory = MemoryManager(max_steps=5, token_budget=100000, keep_images=1)
+    messages = memory.get_memory_as_messages() + [
+        Message.user("step 1", ImageRef(data=JPEG)),
+        Message("assistant", "", [("call-1", "move", '{"command": "forward", "duration": 2}')]),
+    ]
+    memory.add_iteration(messages)
+    step(memory, "step 2", "Done.")
+    assert memory.iterations[0][0].text.endswith("notes on it: moved forward for 2 s]")
+
+
+def test_newest_images_are_kept():
+    memory = MemoryManager(max_steps=5, token_budget=100000, keep_images=2)
+    for i in range(4):
+        step(memory, f"step {i}", "ok")
+    assert images(memory) == [0, 0, 1, 1]
+
+
+def test_iterations_without_images_do_not_count_towards_keep_images():
+    memory = MemoryManager(max_steps=5, token_budget=100000, keep_images=1)
+    step(memory, "step 1", "ok")
+    step(memory, "step 2", "ok", image=False)
+    assert images(memory) == [1, 0]
+
+
+def test_memory_keeps_the_last_max_steps_iterations():
+    memory = MemoryManager(max_steps=2, token_budget=100000)
+    for i in range(4):
+        step(memory, f"step {i}", "ok")
+    assert [iteration[0].text.split(" [")[0] for iteration in memory.iterations] == ["step 2", "step 3"]
+
+
+def test_oldest_iterations_are_dropped_to_fit_the_token_budget():
+    memory = MemoryManager(max_steps=10, token_budget=400, keep_images=0)
+    for i in range(5):
+        step(memory, f"step {i}", "x" * 400)
+    assert memory.estimate_tokens() <= 400
+    assert len(memory.iterations) < 5
+    assert memory.iterations[-1][0].text.startswith("step 4")
+
+
+def test_newest_iteration_is_kept_even_over_budget():
+    memory = MemoryManager(max_steps=10, token_budget=50)
+    step(memory, "step 1", "ok")
+    step(memory, "step 2", "x" * 1000)
+    assert len(memory.iterations) == 1
+    assert memory.iterations[0][0].text.startswith("step 2")
+
+
+def test_spilled_images_are_deleted_when_demoted_or_dropped(tmp_path):
+    memory = MemoryManager(max_steps=2, token_budget=100000, keep_images=1, image_dir=str(tmp_path))
+    step(memory, "step 1", "ok")
+    assert len(os.listdir(tmp_path)) == 1
+    assert memory.iterations[0][0].images[0].data is None  # Only the file holds the bytes
+    for i in range(2, 5):
+        step(memory, f"step {i}", "ok")
+        assert len(os.listdir(tmp_path)) == 1
+    assert memory.iterations[-1][0].images[0].read() == JPEG
+
+
+def test_short_results_are_not_truncated():
+    result = format_result(ExecutionResult("42", "hello\n", "", None), 2000)
+    assert result == "hello\n42"
+
+
+def test_long_results_are_cut_in_the_middle():
+    stdout = "".join(f"line {i}\n" for i in range(1000))
+    result = format_result(ExecutionResult("'done'", stdout, "", None), 300)
+    assert len(result.encode()) <= 300 + 50
+    assert result.startswith("line 0\n")
+    assert result.endswith("line 999\n'done'")
+    full = stdout.rstrip() + "\n'done'"
+    assert f"[... {len(full) - 300} bytes truncated ...]" in result
+
+
+def test_truncation_does_not_split_characters():
+    result = format_result(ExecutionResult("'" + "ü" * 1000 + "'", "", "", None), 101)
+    assert "�" not in result
+    assert len(result.encode()) <= 101 + 50
+
+
+def test_errors_show_the_end_of_the_traceback():
+    stderr = "Traceback (most recent call last):\n" + "".join(f'  File "<cell>", line {i}\n' for i in range(10))
+    stderr += "ZeroDivisionError: division by zero\n"
+    result = format_result(ExecutionResult(None, "", stderr, "ZeroDivisionError: division by zero"), 2000)
+    assert result.startswith("Error:\n")
+    assert result.splitlines()[1:] == stderr.splitlines()[-6:]
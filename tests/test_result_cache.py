@@ -0,0 +1,134 @@
+"""Cache keys, the determinism check and ResultCache/CachingBackend behavior."""
+
+import json
+
+import pytest
+
+from llm_agent.e2b_sandbox import cache as cache_module
+from llm_agent.e2b_sandbox.backends import ExecutionBackend, ExecutionResult
+from llm_agent.e2b_sandbox.cache import CachingBackend, ResultCache, is_deterministic, normalize_code
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "time", clock)
+    return clock
+
+
+def result(text):
+    return ExecutionResult(text, "", "", None)
+
+
+def test_normalize_code_ignores_comments_and_formatting():
+    assert normalize_code("x = 1  # one\n\n\ny=x+1\n") == normalize_code("x = 1\ny = x + 1")
+    assert normalize_code("x = 1") != normalize_code("x = 2")
+
+
+def test_normalize_code_of_invalid_code_drops_comments_and_blank_lines():
+    assert normalize_code("def f(:  # broken\n\n    pass") == "def f(:\n    pass"
+
+
+@pytest.mark.parametrize("code", [
+    "sum(range(10))",
+    "import math\nmath.sqrt(2)",
+    "import numpy as np\nnp.sum([1, 2])",
+    "from fractions import Fraction\nFraction(1, 3)",
+])
+def test_pure_code_is_deterministic(code):
+    assert is_deterministic(code)
+
+
+@pytest.mark.parametrize("code", [
+    "import random\nrandom.random()",
+    "from random import randint\nrandint(1, 6)",
+    "import numpy.random\nnumpy.random.rand()",
+    "import numpy as np\nnp.random.rand()",
+    "from numpy import random\nrandom.rand()",
+    "from numpy import random as r\nr.rand()",
+    "import pandas as pd\npd.Timestamp.now()",
+    "from datetime import date\ndate.today()",
+    "import os\nos.getpid()",
+    "sum(range(10))  # nocache",
+])
+def test_randomness_and_clocks_are_not_deterministic(code):
+    assert not is_deterministic(code)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put("1", result("1"))
+    cache.put("2", result("2"))
+    cache.get("1")
+    cache.put("3", result("3"))
+    assert cache.get("1") == result("1")
+    assert cache.get("2") is None
+    assert cache.get("3") == result("3")
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResultCache(ttl=10)
+    cache.put("1", result("1"))
+    clock.now += 9
+    assert cache.get("1") == result("1")
+    clock.now += 2
+    assert cache.get("1") is None
+
+
+def test_entries_are_reloaded_without_expired_ones(tmp_path, clock):
+    path = str(tmp_path / "cache.jsonl")
+    cache = ResultCache(ttl=10, path=path)
+    cache.put("old", result("old"))
+    clock.now += 5
+    cache.put("new", result("new"))
+    cache.put("new  # same key", result("newer"))
+    with open(path, "a") as file:
+        file.write('{"key": "cut short by a cra')
+
+    clock.now += 6
+    reloaded = ResultCache(ttl=10, path=path)
+    assert reloaded.get("old") is None
+    assert reloaded.get("new") == result("newer")
+    with open(path) as file:
+        assert [json.loads(line)["result"]["text"] for line in file] == ["newer"]
+
+
+class Backend(ExecutionBackend):
+    def __init__(self, stateful=False):
+        self.runs = 0
+        self._stateful = stateful
+
+    @property
+    def stateful(self):
+        return self._stateful
+
+    def run(self, code, timeout=None, on_stdout=None, on_stderr=None):
+        self.runs += 1
+        if on_stdout is not None:
+            on_stdout("out\n")
+        return ExecutionResult(str(self.runs), "out\n", "", None)
+
+
+def test_cache_hit_replays_output_to_callbacks():
+    backend = Backend()
+    caching = CachingBackend(backend)
+    caching.run("sum(range(3))")
+    output = []
+    assert caching.run("sum(range(3))", on_stdout=output.append).text == "1"
+    assert backend.runs == 1
+    assert output == ["out\n"]
+
+
+def test_stateful_backend_is_never_cached():
+    backend = Backend(stateful=True)
+    caching = CachingBackend(backend)
+    caching.run("x += 1; x")
+    assert caching.run("x += 1; x").text == "2"
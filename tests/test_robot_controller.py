@@ -0,0 +1,74 @@
+"""RobotController against the simulated EV3 server (`server.py --sim`)."""
+
+import time
+
+import pytest
+
+import tracing.core as tracing
+from benchmarks.ev3_server_load import free_port, start_simulated_server
+from llm_agent.ev3.robot import RobotCommandError, RobotController
+
+
+@pytest.fixture(scope="module")
+def server_port():
+    port = free_port()
+    server = start_simulated_server(port, time_scale=0.01)
+    yield port
+    server.terminate()
+    server.wait()
+
+
+@pytest.fixture
+def robot(server_port):
+    robot = RobotController("127.0.0.1", server_port, heartbeat_interval=60)
+    yield robot
+    robot.close()
+
+
+@pytest.fixture
+def trace():
+    yield tracing.enable(summary_at_exit=False)
+    tracing.disable()
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def block_writer(robot):
+    """Call with `robot._connect_lock` held: the writer takes a ping and blocks connecting, later commands queue up."""
+    ping = robot.submit("ping")
+    wait_until(robot._outbox.empty)
+    return ping
+
+
+def sent_batches(tracer):
+    return [attributes["commands"] for name, _, _, _, attributes in tracer._spans if name == "robot.send"]
+
+
+def test_commands_queued_together_go_out_in_one_write(robot, trace):
+    with robot._connect_lock:
+        first = block_writer(robot)
+        futures = [robot.submit(command) for command in ("forward 0.5", "beep", "ping")]
+    assert first.result(5) == "pong"
+    assert [future.result(5) for future in futures] == ["forward 0.5", "beep", "pong"]
+    assert sent_batches(trace) == [1, 3]
+
+
+def test_stop_cancels_motions_queued_before_it(robot):
+    with robot._connect_lock:
+        block_writer(robot)
+        forward = robot.submit("forward 1")
+        beep = robot.submit("beep")
+        stop = robot.submit("stop")
+        left = robot.submit("left 0.1")
+    assert stop.result(5) == "stop"
+    with pytest.raises(RobotCommandError, match="Cancelled by stop"):
+        forward.result(5)
+    assert beep.result(5) == "beep"
+    assert left.result(5) == "left 0.1"
+    assert robot.wait_for_motions(5)
+    assert not robot.moving
@@ -0,0 +1,125 @@
+"""Behavior of SandboxPool with a fake sandbox that keeps kernel state per code context."""
+
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from llm_agent.e2b_sandbox.pool import SandboxPool
+
+
+class KernelSandbox:
+    """Runs code with exec, one namespace per code context like the kernels of an E2B sandbox."""
+
+    def __init__(self):
+        self.kernels = {None: {}}
+        self.contexts = itertools.count(1)
+        self.killed = False
+
+    def run_code(self, code, context=None, **kwargs):
+        assert not self.killed, "ran code in a sandbox that was shut down"
+        try:
+            return eval(code, self.kernels[context and context.id])
+        except SyntaxError:
+            exec(code, self.kernels[context and context.id])
+
+    def create_code_context(self):
+        context = SimpleNamespace(id=next(self.contexts))
+        self.kernels[context.id] = {}
+        return context
+
+    def remove_code_context(self, context):
+        del self.kernels[context.id]
+
+    def kill(self):
+        self.killed = True
+
+
+class Factory:
+    """Creates KernelSandboxes; all but the first take `boot_delay` seconds to start."""
+
+    def __init__(self, boot_delay=0.0):
+        self.boot_delay = boot_delay
+        self.sandboxes = []
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        if self.sandboxes:
+            time.sleep(self.boot_delay)
+        sandbox = KernelSandbox()
+        with self.lock:
+            self.sandboxes.append(sandbox)
+        return sandbox
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def factory():
+    return Factory()
+
+
+@pytest.fixture
+def pool(factory):
+    pool = SandboxPool(size=1, factory=factory)
+    yield pool
+    pool.close()
+
+
+def test_leases_do_not_share_kernel_state(pool):
+    for _ in range(5):
+        with pool.lease() as (sandbox, context):
+            assert sandbox.run_code("'x' in globals()", context=context) is False
+            sandbox.run_code("x = 1", context=context)
+
+
+def test_used_sandbox_is_reused_with_a_fresh_context():
+    # The replacement boots slowly, so the second lease waits for the reset of the first sandbox
+    factory = Factory(boot_delay=1.0)
+    pool = SandboxPool(size=1, factory=factory)
+    try:
+        wait_until(lambda: factory.sandboxes)
+        with pool.lease() as (first, context):
+            first.run_code("x = 1", context=context)
+        with pool.lease() as (second, context):
+            assert second is first
+            assert second.run_code("'x' in globals()", context=context) is False
+        assert len(first.kernels) == 2  # The context of the first lease was removed
+    finally:
+        pool.close()
+
+
+def test_session_keeps_kernel_state(pool):
+    with pool.lease("a") as (sandbox, context):
+        sandbox.run_code("x = 1", context=context)
+    with pool.lease("a") as (sandbox, context):
+        assert sandbox.run_code("x", context=context) == 1
+    with pool.lease("b") as (sandbox, context):
+        assert sandbox.run_code("'x' in globals()", context=context) is False
+
+
+def test_sandbox_that_raised_is_shut_down(pool):
+    with pytest.raises(ZeroDivisionError):
+        with pool.lease() as (sandbox, context):
+            sandbox.run_code("1 / 0", context=context)
+    assert sandbox.killed
+    with pool.lease() as (other, context):
+        assert other is not sandbox
+
+
+def test_close_shuts_down_idle_and_session_sandboxes(pool, factory):
+    with pool.lease("a"):
+        pass
+    wait_until(lambda: len(factory.sandboxes) >= 2)
+    pool.close()
+    wait_until(lambda: all(sandbox.killed for sandbox in factory.sandboxes))
+    with pytest.raises(RuntimeError):
+        with pool.lease():
+            pass
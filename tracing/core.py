@@ -0,0 +1,227 @@
+"""
+Lightweight latency tracing of the agent loop.
+
+Code marks stages with `span("stage.name")`. Spans are grouped into iterations of the
+agent loop (see `iteration`), and each finished iteration is written as one JSON line.
+When the process exits, p50/p95 latencies per stage are printed.
+
+Tracing is off by default; `span` then returns a shared no-op context manager, so
+instrumented code pays little more than a function call.
+"""
+
+import atexit
+import json
+import math
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+# Durations kept per stage for the percentiles, so long runs don't grow without bound
+MAX_SAMPLES = 10000
+
+
+class _NullSpan:
+    """Stand-in returned while tracing is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """A timed stage. Attributes added with `set` end up in the trace."""
+
+    __slots__ = ("tracer", "name", "attributes", "start")
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer.add(self.name, self.start, time.perf_counter() - self.start, self.attributes)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """Collects spans, writes them per iteration and keeps the durations for the summary."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._file = open(path, "a", buffering=1) if path else None
+        self._lock = threading.Lock()
+        self._spans = []  # Spans of the current iteration
+        self._durations = {}  # Span name -> deque of the latest durations in seconds
+        self._totals = {}  # Span name -> [count, total seconds]
+        self._iteration = None  # (index, start)
+
+    def add(self, name: str, start: float, duration: float, attributes: dict):
+        with self._lock:
+            self._spans.append((name, start, duration, threading.current_thread().name, attributes))
+            if name not in self._durations:
+                self._durations[name] = deque(maxlen=MAX_SAMPLES)
+                self._totals[name] = [0, 0.0]
+            self._durations[name].append(duration)
+            totals = self._totals[name]
+            totals[0] += 1
+            totals[1] += duration
+
+    def begin_iteration(self, index: int):
+        self.flush()
+        self._iteration = (index, time.perf_counter())
+
+    def end_iteration(self):
+        if self._iteration is not None:
+            index, start = self._iteration
+            self.add("iteration", start, time.perf_counter() - start, {"index": index})
+        self.flush()
+        self._iteration = None
+
+    def flush(self):
+        """Writes the spans collected so far as one JSON line."""
+        with self._lock:
+            spans, self._spans = self._spans, []
+        if not spans or self._file is None:
+            return
+
+        origin = self._iteration[1] if self._iteration is not None else spans[0][1]
+        record = {
+            "iteration": self._iteration[0] if self._iteration is not None else None,
+            "time": time.time(),
+            "spans": [dict(name=name, start_ms=round(1000 * (start - origin), 3),
+                           duration_ms=round(1000 * duration, 3), thread=thread, **attributes)
+                      for name, start, duration, thread, attributes in sorted(spans, key=lambda span: span[1])],
+        }
+        self._file.write(json.dumps(record, default=str) + "\n")
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: Span name -> {"count", "p50_ms", "p95_ms", "total_ms"}, percentiles
+                  over the latest MAX_SAMPLES spans
+        """
+        with self._lock:
+            durations = {name: sorted(values) for name, values in self._durations.items()}
+            totals = {name: tuple(values) for name, values in self._totals.items()}
+        return {name: {"count": totals[name][0],
+                       "p50_ms": 1000 * _percentile(values, 50),
+                       "p95_ms": 1000 * _percentile(values, 95),
+                       "total_ms": 1000 * totals[name][1]}
+                for name, values in durations.items()}
+
+    def print_summary(self):
+        summary = self.summary()
+        if not summary:
+            return
+        print(f"\n{'stage':<28}{'count':>7}{'p50 ms':>11}{'p95 ms':>11}{'total ms':>12}")
+        for name, stats in sorted(summary.items(), key=lambda item: -item[1]["total_ms"]):
+            print(f"{name:<28}{stats['count']:>7}{stats['p50_ms']:>11.2f}{stats['p95_ms']:>11.2f}"
+                  f"{stats['total_ms']:>12.1f}")
+
+    def close(self):
+        self.end_iteration()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _percentile(values: list, percent: float) -> float:
+    """Nearest-rank percentile of sorted `values`."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+_tracer: Optional[Tracer] = None
+
+
+def enable(path: Optional[str] = None, summary_at_exit: bool = True) -> Tracer:
+    """
+    Starts tracing.
+
+    Args:
+        path: JSON lines file the iterations are appended to, None to only keep the summary.
+        summary_at_exit: Print the p50/p95 summary when the process exits.
+    """
+    global _tracer
+    disable()
+    _tracer = Tracer(path)
+    if summary_at_exit:
+        atexit.register(_shutdown, _tracer)
+    return _tracer
+
+
+def disable():
+    """Stops tracing without printing the summary."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        atexit.unregister(_shutdown)
+        tracer.close()
+
+
+def _shutdown(tracer: Tracer):
+    tracer.close()
+    tracer.print_summary()
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def span(name: str, **attributes):
+    """
+    Times the `with` block as stage `name`:
+
+        with span("llm.request", round=1) as s:
+            ...
+            s.set(tool_calls=2)
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return Span(_tracer, name, attributes)
+
+
+def record(name: str, duration: float, **attributes):
+    """Adds a stage timed elsewhere, e.g. from a callback. `duration` is in seconds."""
+    if _tracer is not None:
+        _tracer.add(name, time.perf_counter() - duration, duration, attributes)
+
+
+class iteration:
+    """Groups the spans of one agent loop iteration: `with iteration(i): ...`"""
+
+    def __init__(self, index: int):
+        self.index = index
+
+    def __enter__(self):
+        if _tracer is not None:
+            _tracer.begin_iteration(self.index)
+        return self
+
+    def __exit__(self, *exc_info):
+        if _tracer is not None:
+            _tracer.end_iteration()
+        return False